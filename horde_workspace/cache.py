@@ -0,0 +1,171 @@
+import asyncio
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from os import PathLike
+from pathlib import Path
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class ResultCache:
+    """
+    Content-addressed cache of Horde results, keyed by a hash of the normalized request.
+
+    Each entry is a directory holding a small JSON document and its binary blobs, e.g., images.
+    Entries expire after ttl seconds, and the least recently used ones are evicted once max_size bytes are exceeded.
+    Identical requests in flight at the same time are merged into one.
+
+    The total size is tracked as entries are written, the directory is only scanned when it exceeds max_size, or
+    every scan_interval seconds to catch expired entries and writes by other processes.
+    """
+
+    def __init__(
+        self,
+        directory: PathLike | str,
+        ttl: float = 30 * 24 * 60 * 60,
+        max_size: int = 2 * 1024**3,
+        scan_interval: float = 60 * 60,
+    ) -> None:
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.scan_interval = scan_interval
+
+        # Unknown until the first scan
+        self._size: int | None = None
+        self._scanned = -math.inf
+
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._waiters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[dict, list[bytes]] | None:
+        path = self.directory / key
+        meta_path = path / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text())
+            if time.time() - meta["time"] > self.ttl:
+                with self._lock:
+                    self._remove(path)
+                return None
+            blobs = [(path / f"{i}.bin").read_bytes() for i in range(meta["blobs"])]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # The modification time of the meta file tracks the last access
+        meta_path.touch()
+        return meta["data"], blobs
+
+    def put(self, key: str, data: dict, blobs: list[bytes] | None = None) -> None:
+        blobs = blobs or []
+
+        # Write into a temporary directory first, so readers never see partial entries
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{key}.{uuid.uuid4()}"
+        tmp.mkdir()
+        for i, blob in enumerate(blobs):
+            (tmp / f"{i}.bin").write_bytes(blob)
+        (tmp / "meta.json").write_text(
+            json.dumps({"time": time.time(), "blobs": len(blobs), "data": data})
+        )
+        size = _entry_size(tmp)
+
+        path = self.directory / key
+        with self._lock:
+            self._remove(path)
+            os.replace(tmp, path)
+            if self._size is not None:
+                self._size += size
+            due = (
+                self._size is None
+                or self._size > self.max_size
+                or time.monotonic() - self._scanned > self.scan_interval
+            )
+
+        if due:
+            self.evict()
+
+    def _remove(self, path: Path) -> None:
+        if self._size is not None:
+            try:
+                self._size -= _entry_size(path)
+            except OSError:
+                # Nothing to replace
+                pass
+        shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self) -> None:
+        """Removes expired entries, then the least recently used ones until the cache fits 90% of max_size."""
+        if not self.directory.exists():
+            return
+
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path in self.directory.iterdir():
+                if path.name.startswith("."):
+                    continue
+                try:
+                    accessed = (path / "meta.json").stat().st_mtime
+                    size = _entry_size(path)
+                except OSError:
+                    continue
+                if now - accessed > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    entries.append((accessed, size, path))
+
+            # Make some room, so the next writes do not trigger a scan right away
+            total = sum(size for _, size, _ in entries)
+            target = self.max_size * 0.9 if total > self.max_size else self.max_size
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+            self._size = total
+            self._scanned = time.monotonic()
+
+    async def dedupe(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Awaits factory, unless an identical request is already in flight, in which case its result is shared.
+
+        The shared request is only cancelled once every caller waiting on it has been cancelled.
+        """
+        future = self._inflight.get(key)
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            self._waiters[key] = 0
+
+            def done(_: asyncio.Future) -> None:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+                    del self._waiters[key]
+
+            future.add_done_callback(done)
+
+        self._waiters[key] += 1
+        try:
+            # A cancelled caller must not cancel the request for everyone else waiting on it
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._inflight.get(key) is future:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    future.cancel()
+
+                    # Let the request clean up, e.g., delete itself on the Horde
+                    await asyncio.wait([future])
+            raise
+
+
+def _entry_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir())
@@ -0,0 +1,108 @@
+import asyncio
+import functools
+from os import PathLike
+from pathlib import Path
+from typing import Iterable, Protocol
+
+import aiohttp
+
+from horde_workspace.cache import ResultCache
+from horde_workspace.client import HordeClient
+from horde_workspace.ratelimit import backoff_delay
+
+CACHE_DIRECTORY = Path.home() / ".cache" / "horde-workspace" / "civitai"
+
+
+class Resolvable(Protocol):
+    @property
+    def resolved(self) -> bool: ...
+
+    async def async_resolve(self, civitai: "CivitAI") -> bool: ...
+
+
+class CivitAI:
+    """
+    Async CivitAI metadata lookups over a pooled session, backed by a persistent TTL cache.
+
+    Concurrent lookups of the same model or version are merged, and at most max_in_flight requests run at once.
+    """
+
+    def __init__(
+        self,
+        client: HordeClient | None = None,
+        directory: PathLike | str = CACHE_DIRECTORY,
+        base_url: str = "https://civitai.com/api/v1",
+        ttl: float = 7 * 24 * 60 * 60,
+        max_in_flight: int = 8,
+        retries: int = 3,
+    ) -> None:
+        """
+        :param client: Provides the pooled session and event loop, a dedicated one by default
+        :param directory: Where to cache responses
+        :param ttl: How long cached responses are used in seconds
+        """
+        self.client = client or HordeClient()
+        self.cache = ResultCache(directory, ttl=ttl)
+        self.base_url = base_url
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+
+        self._semaphores: dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def get(self, path: str) -> dict:
+        key = path.replace("/", "-")
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached[0]
+
+        async def fetch() -> dict:
+            url = f"{self.base_url}/{path}"
+            attempt = 0
+            while True:
+                try:
+                    async with self._semaphore():
+                        async with self.client.session.get(url) as response:
+                            if response.status != 200:
+                                raise ValueError(
+                                    f"Failed to resolve model: {await response.text()}"
+                                )
+                            data = await response.json()
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt >= self.retries:
+                        raise
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+
+            await asyncio.to_thread(self.cache.put, key, data)
+            return data
+
+        return await self.cache.dedupe(key, fetch)
+
+    async def model(self, model_id: int) -> dict:
+        return await self.get(f"models/{model_id}")
+
+    async def model_version(self, version_id: int) -> dict:
+        return await self.get(f"model-versions/{version_id}")
+
+    async def resolve_many(self, items: Iterable[Resolvable]) -> list[bool]:
+        """Resolves many LoRAs or embeddings concurrently, returning which of them changed."""
+        return await asyncio.gather(*[item.async_resolve(self) for item in items])
+
+    def resolve(self, item: Resolvable) -> bool:
+        """Synchronously resolves a LoRA or embedding, returning whether it changed."""
+        return self.client.run(item.async_resolve(self))
+
+
+@functools.cache
+def get_civitai() -> CivitAI:
+    """The shared resolver used by Lora.resolve and Embedding.resolve."""
+    return CivitAI()
@@ -2,7 +2,7 @@ from typing import Literal
 
 from pydantic import BaseModel
 
-from horde_workspace.utils import get
+from horde_workspace.civitai import CivitAI, get_civitai
 
 
 class Embedding(BaseModel):
@@ -17,9 +17,19 @@ class Embedding(BaseModel):
         e.resolve()
         return e
 
+    @property
+    def resolved(self) -> bool:
+        """Whether the name is known, so resolving would not change anything."""
+        return bool(self.name)
+
     def resolve(self) -> bool:
+        if self.resolved:
+            return False
+        return get_civitai().resolve(self)
+
+    async def async_resolve(self, civitai: CivitAI) -> bool:
         if not self.name:
-            data = get(f"https://civitai.com/api/v1/models/{self.id}")
+            data = await civitai.model(self.id)
             self.name = data["name"]
             return True
         return False
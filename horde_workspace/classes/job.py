@@ -1,5 +1,5 @@
 from PIL import Image
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, field_validator
 
 from horde_workspace.classes.embedding import Embedding
 from horde_workspace.classes.lora import Lora
@@ -27,3 +27,19 @@ class Job(BaseModel):
     hires: bool = False
     control_type: str | None = None
     source_image: Image.Image | None = None
+
+    @field_validator("seed", mode="before")
+    @classmethod
+    def _seed_from_number(cls, value):
+        # Seeds are sent as strings, but may be given as numbers, e.g., by sweeps
+        return (
+            str(value)
+            if isinstance(value, int) and not isinstance(value, bool)
+            else value
+        )
+
+    @field_validator("size", mode="before")
+    @classmethod
+    def _size_from_json(cls, value):
+        # Sizes are serialized as lists, e.g., in the journal
+        return tuple(value) if isinstance(value, list) else value
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 
-from horde_workspace.utils import get
+from horde_workspace.civitai import CivitAI, get_civitai
 
 
 class Lora(BaseModel):
@@ -15,16 +15,26 @@ class Lora(BaseModel):
         e.resolve()
         return e
 
-    def resolve(self):
+    @property
+    def resolved(self) -> bool:
+        """Whether both IDs are known, so resolving would not change anything."""
+        return self.id != -1 and self.version_id != -1
+
+    def resolve(self) -> bool:
+        if self.resolved:
+            return False
+        return get_civitai().resolve(self)
+
+    async def async_resolve(self, civitai: CivitAI) -> bool:
         if self.version_id == -1 and self.id == -1:
             raise ValueError("model_id or version_id must be set")
         elif self.id == -1:
-            data = get(f"https://civitai.com/api/v1/model-versions/{self.version_id}")
+            data = await civitai.model_version(self.version_id)
             self.name = data["model"]["name"]
             self.id = data["modelId"]
             return True
         elif self.version_id == -1:
-            data = get(f"https://civitai.com/api/v1/models/{self.id}")
+            data = await civitai.model(self.id)
             self.name = data["name"]
             self.version_id = data["modelVersions"][0]["id"]
             return True
@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator, TypeVar
+
+import aiohttp
+from attr import dataclass
+
+from horde_workspace.poller import StatusPoller
+from horde_workspace.ratelimit import TokenBucket, backoff_delay, parse_retry_after
+from horde_workspace.utils import APIError, TransientAPIError
+
+T = TypeVar("T")
+
+
+@dataclass
+class RequestTiming:
+    method: str
+    url: str
+    attempt: int = 0
+    status: int | None = None
+    size: int = 0
+    elapsed: float = 0.0
+    error: str | None = None
+
+
+class HordeClient:
+    """
+    Long-lived HTTP client shared by all Horde API calls of a workspace.
+
+    Keeps one pooled aiohttp session per event loop, so DNS lookups, TCP and TLS connections are reused across
+    submissions, polls and downloads. Synchronous callers are funneled through a background event loop owned by
+    the client, which keeps all of them on the same pool.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "https://stablehorde.net/api/v2",
+        client_agent: str = "horde-workspace:0:https://github.com/Luke100000/horde-workspace",
+        timeout: float = 60.0,
+        connect_timeout: float = 15.0,
+        poll_timeout: float = 20.0,
+        transport: Callable[[], aiohttp.ClientSession] | None = None,
+        limit: int = 100,
+        limit_per_host: int = 32,
+        keepalive_timeout: float = 60.0,
+        dns_cache_ttl: int = 300,
+        max_poll_rate: float | None = 5.0,
+        max_request_rate: float | None = None,
+        max_retries: int = 5,
+    ) -> None:
+        """
+        :param base_url: Root of the Horde API, e.g., a regional mirror or a local caching proxy
+        :param timeout: Total timeout of a single HTTP call in seconds
+        :param connect_timeout: Timeout for establishing a connection in seconds
+        :param poll_timeout: Total timeout of status checks and cancellations in seconds
+        :param transport: Factory for the underlying session, called once per event loop, replacing the pooled default
+        :param max_poll_rate: Base budget of status checks per second across all requests, growing by one per
+            outstanding request, unlimited if None
+        :param max_request_rate: Cap on requests per second, unlimited if None. Either way, all requests pause after
+            a 429 until Retry-After has passed
+        """
+        self.base_url = base_url
+        self.client_agent = client_agent
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.poll_timeout = poll_timeout
+        self.transport = transport
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.max_poll_rate = max_poll_rate
+        self.max_retries = max_retries
+
+        # Shared by every request of this client, regardless of loop or thread
+        self.limiter = TokenBucket(max_request_rate, max_request_rate or 1.0)
+
+        # Called with the timing of every HTTP call, including retries
+        self.hooks: list[Callable[[RequestTiming], None]] = []
+
+        self._sessions: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._pollers: dict[asyncio.AbstractEventLoop, StatusPoller] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The pooled session of the running event loop, created on first use."""
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # Sessions of loops which are gone can no longer be used or closed
+            for other in [other for other in self._sessions if other.is_closed()]:
+                del self._sessions[other]
+
+            if self.transport is None:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(
+                        total=self.timeout, connect=self.connect_timeout
+                    ),
+                    trust_env=True,
+                )
+            else:
+                session = self.transport()
+            self._sessions[loop] = session
+        return session
+
+    @property
+    def poller(self) -> StatusPoller:
+        """The status poller of the running event loop, shared by all outstanding requests."""
+        loop = asyncio.get_running_loop()
+        poller = self._pollers.get(loop)
+        if poller is None:
+            for other in [other for other in self._pollers if other.is_closed()]:
+                del self._pollers[other]
+
+            poller = StatusPoller(max_rate=self.max_poll_rate)
+            self._pollers[loop] = poller
+        return poller
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url.rstrip('/')}/{path}"
+
+    def headers(self, apikey: str) -> dict:
+        return {
+            "apikey": apikey,
+            "Client-Agent": self.client_agent,
+            "Content-Type": "application/json",
+        }
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict,
+        payload: dict | None = None,
+        timeout: float | None = None,
+    ) -> dict:
+        """
+        Performs a rate limited JSON request against the Horde.
+
+        Rate limits (429) are retried indefinitely, honoring Retry-After and pausing the shared limiter.
+        Other transient failures are retried with exponential backoff up to max_retries, but a POST only when it
+        cannot have reached the server, to never submit the same job twice.
+
+        :param timeout: Overrides the client's total timeout for each attempt of this call
+        """
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+
+            retry_after = None
+            timing = RequestTiming(method=method, url=url, attempt=attempt)
+            start = time.perf_counter()
+            try:
+                async with self.session.request(
+                    method, url, json=payload, headers=headers, **kwargs
+                ) as response:
+                    timing.status = response.status
+                    timing.size = len(await response.read())
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+                    if response.status == 429:
+                        pass
+                    elif response.status >= 500 and method != "POST":
+                        raise TransientAPIError(
+                            f"Error during request {url}: {response.status}, {await response.text()}"
+                        )
+                    elif response.status not in [200, 202]:
+                        raise APIError(
+                            f"Error during request {url}: {response.status}, {await response.text()}"
+                        )
+                    else:
+                        response_data = await response.json()
+                        logging.debug(
+                            "Response from %s %s: %s", method, url, response_data
+                        )
+
+                        return response_data
+            except (TransientAPIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                timing.error = str(e) or type(e).__name__
+                retryable = method != "POST" or isinstance(
+                    e, aiohttp.ClientConnectorError
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise TransientAPIError(e) from e
+
+                delay = max(backoff_delay(attempt), retry_after or 0.0)
+                logging.info(
+                    "Request to %s failed (%s), retrying in %.1fs", url, e, delay
+                )
+            except APIError as e:
+                timing.error = str(e)
+                raise
+            except Exception as e:
+                timing.error = str(e) or type(e).__name__
+                raise APIError(e) from e
+            else:
+                # Rate limited
+                delay = backoff_delay(attempt) + (retry_after or 0.0)
+                logging.info("Rate limited, waiting %.1fs", delay)
+                self.limiter.pause(delay)
+            finally:
+                timing.elapsed = time.perf_counter() - start
+                for hook in self.hooks:
+                    hook(timing)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def cancel(self, url: str, headers: dict) -> bool:
+        """
+        Deletes a request on the Horde, returning whether it succeeded.
+
+        The DELETE is shielded, so it still goes out when the caller itself is being cancelled.
+        """
+        task = asyncio.ensure_future(
+            self.request("DELETE", url, headers, timeout=self.poll_timeout)
+        )
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Cancelled again while waiting, the DELETE finishes in the background
+            raise
+        except Exception as e:
+            logging.warning("Could not cancel %s: %s", url, e)
+            return False
+        return True
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="horde-client",
+                    daemon=True,
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        """Schedules a coroutine on the client's background event loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Runs a coroutine on the client's background event loop and waits for the result."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self._loop:
+            coro.close()
+            raise RuntimeError("Cannot block on the client's own event loop")
+        return self.submit(coro).result()
+
+    def iterate(self, iterator: AsyncIterator[T]) -> Iterator[T]:
+        """Consumes an async iterator on the background event loop, yielding its items as they arrive."""
+        items: queue.Queue[tuple[bool, Any]] = queue.Queue()
+        done = object()
+
+        async def consume() -> None:
+            end: tuple[bool, Any] = (True, asyncio.CancelledError())
+            try:
+                async for item in iterator:
+                    items.put((False, item))
+            except Exception as e:
+                end = (True, e)
+            else:
+                end = (False, done)
+            finally:
+                # Also when cancelled, e.g., by close() from another thread, so the caller never waits forever
+                items.put(end)
+
+        future = self.submit(consume())
+        try:
+            while True:
+                failed, item = items.get()
+                if failed:
+                    raise item
+                if item is done:
+                    return
+                yield item
+        finally:
+            # Abandoning the iterator early cancels whatever is still in flight
+            future.cancel()
+
+    async def aclose(self) -> None:
+        """Closes the session of the running event loop."""
+        loop = asyncio.get_running_loop()
+        self._pollers.pop(loop, None)
+        session = self._sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    async def _shutdown(self) -> None:
+        # Cancel what is still running on the background loop, e.g., consumers of iterate, before closing the session
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.aclose()
+
+    def close(self) -> None:
+        """Closes the background event loop and its session, cancelling everything still running on it."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+
+        if loop is not None and thread is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
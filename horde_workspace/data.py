@@ -1,46 +1,140 @@
+import json
+import logging
+import os
+import threading
 from pathlib import Path
+from typing import Generic, Iterator, Mapping, TypeVar
 
-from pydantic_yaml import parse_yaml_raw_as, to_yaml_str
+from pydantic import BaseModel
 
 from horde_workspace.classes.embedding import Embedding
 from horde_workspace.classes.lora import Lora
 from horde_workspace.classes.model import Model
 
-MODELS: dict[str, Model] = {}
-LORAS: dict[str, Lora] = {}
-EMBEDDINGS: dict[str, Embedding] = {}
+T = TypeVar("T", bound=BaseModel)
 
-SNIPPETS = {
-    "watermark": "watermark, signature, logo, branding, copyright, censored, text",
-    "good": "score_9, score_8_up, score_7_up, score_6_up, score_5_up, masterpiece",
-    "bad": "score_6, score_5, score_4, blurry, lowres, worst quality, low quality, pixelated, bad art, bad quality",
-    "deformed": "deformed, bad anatomy, bad hands, bad hand",
-}
 
-root = Path(__file__).parent
+class Registry(Mapping[str, T], Generic[T]):
+    """
+    Read-only mapping of the YAML definitions in a data directory, loaded on first access.
+
+    Parsed definitions are kept in a JSON index next to the YAML files, which is rebuilt whenever a file is added,
+    removed or modified. Incomplete LoRAs and embeddings are resolved against CivitAI only when looked up,
+    never while loading.
+    """
+
+    def __init__(self, directory: Path, cls: type[T]) -> None:
+        self.directory = directory
+        self.cls = cls
+        self.index_path = directory / ".index.json"
+
+        self._entries: dict[str, T] | None = None
+        self._lock = threading.RLock()
+
+    def _stamps(self) -> dict[str, list[int]]:
+        stamps = {}
+        for yaml in self.directory.glob("*.yaml"):
+            stat = yaml.stat()
+            stamps[yaml.stem] = [stat.st_mtime_ns, stat.st_size]
+        return stamps
+
+    def _load(self) -> dict[str, T]:
+        with self._lock:
+            if self._entries is not None:
+                return self._entries
+
+            stamps = self._stamps()
+            try:
+                index = json.loads(self.index_path.read_text())
+                if index["stamps"] == stamps:
+                    self._entries = {
+                        name: self.cls.model_validate(data)
+                        for name, data in index["entries"].items()
+                    }
+                    return self._entries
+            except (OSError, ValueError, KeyError):
+                pass
+
+            from pydantic_yaml import parse_yaml_raw_as
+
+            entries = {}
+            for name in stamps:
+                with open(self.directory / f"{name}.yaml", "r") as f:
+                    entries[name] = parse_yaml_raw_as(self.cls, f.read())
 
-for yaml in Path(root / "data/models").glob("*.yaml"):
-    with open(yaml, "r") as f:
-        model = parse_yaml_raw_as(Model, f.read())
+            try:
+                tmp = self.index_path.with_suffix(".tmp")
+                tmp.write_text(
+                    json.dumps(
+                        {
+                            "stamps": stamps,
+                            "entries": {
+                                name: entry.model_dump(mode="json")
+                                for name, entry in entries.items()
+                            },
+                        }
+                    )
+                )
+                os.replace(tmp, self.index_path)
+            except OSError as e:
+                # E.g., installed into a read-only location
+                logging.debug("Could not write registry index: %s", e)
 
-    MODELS[yaml.stem] = model
+            self._entries = entries
+            return entries
 
-for yaml in Path(root / "data/loras").glob("*.yaml"):
-    with open(yaml, "r") as f:
-        lora = parse_yaml_raw_as(Lora, f.read())
+    def _write(self, name: str, entry: T) -> None:
+        from pydantic_yaml import to_yaml_str
 
-    if lora.resolve():
-        with open(yaml, "w") as f:
-            f.write(to_yaml_str(lora))
+        with open(self.directory / f"{name}.yaml", "w") as f:
+            f.write(to_yaml_str(entry))
 
-    LORAS[yaml.stem] = lora
+    def __getitem__(self, name: str) -> T:
+        entry = self._load()[name]
 
-for yaml in Path(root / "data/embeddings").glob("*.yaml"):
-    with open(yaml, "r") as f:
-        embedding = parse_yaml_raw_as(Embedding, f.read())
+        # Only incomplete LoRAs and embeddings are looked up on CivitAI
+        if not getattr(entry, "resolved", True):
+            with self._lock:
+                if entry.resolve():  # pyright: ignore [reportAttributeAccessIssue]
+                    self._write(name, entry)
 
-    if embedding.resolve():
-        with open(yaml, "w") as f:
-            f.write(to_yaml_str(embedding))
+        return entry
 
-    EMBEDDINGS[yaml.stem] = embedding
+    def resolve_all(self) -> None:
+        """Resolves all incomplete entries concurrently, e.g., after adding a batch of LoRAs."""
+        incomplete = {
+            name: entry
+            for name, entry in self._load().items()
+            if not getattr(entry, "resolved", True)
+        }
+        if not incomplete:
+            return
+
+        from horde_workspace.civitai import get_civitai
+
+        civitai = get_civitai()
+        with self._lock:
+            changed = civitai.client.run(civitai.resolve_many(incomplete.values()))
+            for (name, entry), resolved in zip(incomplete.items(), changed):
+                if resolved:
+                    self._write(name, entry)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+
+root = Path(__file__).parent
+
+MODELS: Registry[Model] = Registry(root / "data/models", Model)
+LORAS: Registry[Lora] = Registry(root / "data/loras", Lora)
+EMBEDDINGS: Registry[Embedding] = Registry(root / "data/embeddings", Embedding)
+
+SNIPPETS = {
+    "watermark": "watermark, signature, logo, branding, copyright, censored, text",
+    "good": "score_9, score_8_up, score_7_up, score_6_up, score_5_up, masterpiece",
+    "bad": "score_6, score_5, score_4, blurry, lowres, worst quality, low quality, pixelated, bad art, bad quality",
+    "deformed": "deformed, bad anatomy, bad hands, bad hand",
+}
@@ -0,0 +1,99 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from horde_workspace.utils import b64_encode_image
+
+
+class ImageEncoder:
+    """
+    Encodes source images for submission as base64, caching the result per image content.
+
+    Images opened from an unchanged WebP, PNG or JPEG file are sent as the original file bytes without re-encoding.
+    Note that this cannot detect pixels edited in place after loading, copy such images first.
+    """
+
+    passthrough_formats = {"WEBP", "PNG", "JPEG"}
+
+    def __init__(
+        self,
+        quality: int = 80,
+        method: int = 0,
+        lossless: bool = False,
+        passthrough: bool = True,
+        max_passthrough_size: int = 4 * 1024**2,
+        max_entries: int = 16,
+    ) -> None:
+        """
+        :param quality: WebP quality, or compression effort when lossless
+        :param method: WebP encoder speed from 0 (fast) to 6 (small)
+        :param lossless: Whether to encode lossless WebP
+        :param passthrough: Whether to send files from disk as they are
+        :param max_passthrough_size: Files larger than this are re-encoded to save upload bandwidth
+        :param max_entries: Number of encoded images to keep
+        """
+        self.quality = quality
+        self.method = method
+        self.lossless = lossless
+        self.passthrough = passthrough
+        self.max_passthrough_size = max_passthrough_size
+        self.max_entries = max_entries
+
+        self._cache: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, image: Image.Image) -> str:
+        key = self._file_key(image) if self.passthrough else None
+        if key is None:
+            key = (
+                hashlib.blake2b(image.tobytes()).hexdigest(),
+                image.mode,
+                image.size,
+                self.quality,
+                self.method,
+                self.lossless,
+            )
+
+        with self._lock:
+            encoded = self._cache.get(key)
+            if encoded is not None:
+                self._cache.move_to_end(key)
+                return encoded
+
+        if key[0] == "file":
+            with open(key[1], "rb") as f:
+                encoded = base64.b64encode(f.read()).decode("utf-8")
+        else:
+            encoded = b64_encode_image(
+                image, quality=self.quality, method=self.method, lossless=self.lossless
+            )
+
+        with self._lock:
+            self._cache[key] = encoded
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return encoded
+
+    def _file_key(self, image: Image.Image) -> tuple | None:
+        """Identifies the file an image was loaded from, if it can be sent as is."""
+        filename = getattr(image, "filename", None)
+        if not filename or image.format not in self.passthrough_formats:
+            return None
+
+        try:
+            stat = os.stat(filename)
+            if stat.st_size > self.max_passthrough_size:
+                return None
+
+            # Catch in-place resizes and conversions, which keep the file attributes
+            with Image.open(filename) as original:
+                if original.size != image.size or original.mode != image.mode:
+                    return None
+        except OSError:
+            return None
+
+        return "file", os.fspath(filename), stat.st_mtime_ns, stat.st_size
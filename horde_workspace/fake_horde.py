@@ -0,0 +1,356 @@
+import asyncio
+import base64
+import io
+import random
+import time
+import uuid
+import weakref
+from collections import Counter
+
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+
+class _FakeRequest:
+    def __init__(
+        self, kind: str, finish_times: list[float], faulted: bool, forms: list[str]
+    ) -> None:
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.created = time.monotonic()
+        self.finish_times = finish_times
+        self.faulted = faulted
+        self.forms = forms
+        self.cancelled = False
+
+    def finished(self, now: float) -> int:
+        return sum(t <= now for t in self.finish_times)
+
+    def done(self, now: float) -> bool:
+        return self.finished(now) == len(self.finish_times)
+
+
+class FakeHorde:
+    """
+    In-process stand-in for the stablehorde.net v2 endpoints used by the generate and alchemist processors.
+
+    Simulates network latency, queue delay, processing time, rate limits and faults, and counts requests and
+    connections, so client-side throughput can be measured and regression-tested offline.
+
+    Usage::
+
+        async with FakeHorde(queue_delay=2.0) as horde:
+            ws.client.base_url = horde.url
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        queue_delay: float = 1.0,
+        process_time: float = 1.0,
+        rate_limit: float = 0.0,
+        retry_after: float = 1.0,
+        fault_rate: float = 0.0,
+        image_size: int = 512,
+        r2: bool = True,
+        models: dict[str, int] | None = None,
+        seed: int = 42,
+    ) -> None:
+        """
+        :param latency: Delay added to every response in seconds
+        :param queue_delay: Mean time a request waits before workers pick it up
+        :param process_time: Mean time a worker needs per image
+        :param rate_limit: Probability of answering with 429
+        :param retry_after: Retry-After sent along with a 429
+        :param fault_rate: Probability of a request being faulted
+        :param image_size: Width and height of the returned images
+        :param r2: Whether to serve images by URL (like R2) instead of inline base64
+        :param models: Number of workers serving each model, as reported by the stats endpoints
+        """
+        self.latency = latency
+        self.queue_delay = queue_delay
+        self.process_time = process_time
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.fault_rate = fault_rate
+        self.r2 = r2
+        self.models = models or {}
+
+        self.random = random.Random(seed)
+        self.requests: dict[str, _FakeRequest] = {}
+        self.counts: Counter[str] = Counter()
+        self.peak_connections = 0
+
+        self._transports: weakref.WeakSet = weakref.WeakSet()
+        self._connections = 0
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+        pixels = np.random.default_rng(seed).integers(
+            0, 256, (image_size, image_size, 3), dtype=np.uint8
+        )
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="webp")
+        self.image = buffer.getvalue()
+
+    @property
+    def connections(self) -> int:
+        """Number of TCP connections opened by clients so far."""
+        return self._connections
+
+    @property
+    def open_connections(self) -> int:
+        return sum(not t.is_closing() for t in self._transports)
+
+    def _app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post("/api/v2/generate/async", self._generate_async)
+        app.router.add_get("/api/v2/generate/check/{id}", self._generate_check)
+        app.router.add_get("/api/v2/generate/status/{id}", self._generate_status)
+        app.router.add_delete("/api/v2/generate/status/{id}", self._generate_cancel)
+        app.router.add_post("/api/v2/interrogate/async", self._interrogate_async)
+        app.router.add_get("/api/v2/interrogate/status/{id}", self._interrogate_status)
+        app.router.add_delete(
+            "/api/v2/interrogate/status/{id}", self._interrogate_cancel
+        )
+        app.router.add_get("/api/v2/status/models", self._status_models)
+        app.router.add_get("/api/v2/workers", self._workers)
+        app.router.add_get("/r2/{name}", self._image)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving on the running event loop and returns the API base URL."""
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/api/v2"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeHorde":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        transport = request.transport
+        if transport is not None and transport not in self._transports:
+            self._transports.add(transport)
+            self._connections += 1
+            self.peak_connections = max(self.peak_connections, self.open_connections)
+
+        route = request.match_info.route.resource
+        self.counts[
+            f"{request.method} {route.canonical if route else request.path}"
+        ] += 1
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if self.rate_limit > 0 and self.random.random() < self.rate_limit:
+            return web.json_response(
+                {"message": "Rate limited"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        return await handler(request)
+
+    def _get(self, request: web.Request, kind: str) -> _FakeRequest:
+        fake = self.requests.get(request.match_info["id"])
+        if fake is None or fake.kind != kind:
+            raise web.HTTPNotFound()
+        return fake
+
+    def _new_request(self, kind: str, count: int, forms: list[str]) -> _FakeRequest:
+        now = time.monotonic()
+        start = now
+        if self.queue_delay > 0:
+            start += self.random.expovariate(1.0 / self.queue_delay)
+        finish_times = [
+            start + self.process_time * self.random.uniform(0.5, 1.5)
+            for _ in range(count)
+        ]
+        fake = _FakeRequest(
+            kind, finish_times, self.random.random() < self.fault_rate, forms
+        )
+        self.requests[fake.id] = fake
+        return fake
+
+    def _image_url(self, request: web.Request, name: str) -> str:
+        if self.r2:
+            return str(request.url.with_path(f"/r2/{name}.webp").with_query(None))
+        return base64.b64encode(self.image).decode("utf-8")
+
+    async def _image(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.image, content_type="image/webp")
+
+    async def _generate_async(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        params = payload.get("params", {})
+        n = params.get("n", 1)
+        kudos = n * params.get("steps", 30) * params.get("width", 512) / 512
+        if payload.get("dry_run"):
+            return web.json_response({"kudos": kudos})
+        fake = self._new_request("generate", n, [])
+        return web.json_response({"id": fake.id, "kudos": kudos}, status=202)
+
+    def _check(self, fake: _FakeRequest) -> dict:
+        now = time.monotonic()
+        finished = fake.finished(now)
+        started = sum(t - self.process_time <= now for t in fake.finish_times)
+        waiting = len(fake.finish_times) - max(started, finished)
+        queued = [
+            r
+            for r in self.requests.values()
+            if not r.done(now) and r.created < fake.created
+        ]
+        return {
+            "finished": finished,
+            "processing": max(0, started - finished),
+            "restarted": 0,
+            "waiting": waiting,
+            "done": fake.done(now) and not fake.faulted,
+            "faulted": fake.faulted,
+            "wait_time": int(max(0.0, max(fake.finish_times) - now)),
+            "queue_position": len(queued) if waiting else 0,
+            "kudos": 0,
+            "is_possible": True,
+        }
+
+    async def _generate_check(self, request: web.Request) -> web.Response:
+        return web.json_response(self._check(self._get(request, "generate")))
+
+    async def _generate_status(self, request: web.Request) -> web.Response:
+        fake = self._get(request, "generate")
+        now = time.monotonic()
+        data = self._check(fake)
+        data["generations"] = [
+            {
+                "id": f"{fake.id}-{i}",
+                "img": self._image_url(request, f"{fake.id}-{i}"),
+                "seed": str(i),
+                "censored": False,
+                "worker_id": "fake",
+                "worker_name": "fake",
+                "model": "fake",
+                "state": "ok",
+            }
+            for i, t in enumerate(fake.finish_times)
+            if t <= now and not fake.faulted
+        ]
+        return web.json_response(data)
+
+    async def _generate_cancel(self, request: web.Request) -> web.Response:
+        fake = self._get(request, "generate")
+        fake.cancelled = True
+        del self.requests[fake.id]
+        return web.json_response(self._check(fake))
+
+    async def _status_models(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "name": name,
+                    "count": count,
+                    "performance": count * 1.0,
+                    "queued": 0,
+                    "jobs": 0,
+                    "eta": int(self.queue_delay / count) if count else 0,
+                    "type": "image",
+                }
+                for name, count in self.models.items()
+            ]
+        )
+
+    async def _workers(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "id": f"{name}-{i}",
+                    "name": f"{name} worker {i}",
+                    "type": "image",
+                    "online": True,
+                    "trusted": i == 0,
+                    "maintenance_mode": False,
+                    "models": [name],
+                    "max_pixels": 1024 * 1024 * 4,
+                    "performance": f"{0.2 + 0.2 * i} megapixelsteps per second",
+                }
+                for name, count in self.models.items()
+                for i in range(count)
+            ]
+        )
+
+    async def _interrogate_async(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        forms = [form["name"] for form in payload.get("forms", [])]
+        fake = self._new_request("interrogate", len(forms), forms)
+        return web.json_response({"id": fake.id}, status=202)
+
+    def _form_result(self, request: web.Request, fake: _FakeRequest, form: str):
+        if form == "caption":
+            return {"caption": "a fake caption"}
+        if form == "nsfw":
+            return {"nsfw": False}
+        if form == "interrogation":
+            empty = [{"text": "fake", "confidence": 1.0}]
+            return {
+                "interrogation": {
+                    key: empty
+                    for key in (
+                        "tags",
+                        "sites",
+                        "artists",
+                        "flavors",
+                        "mediums",
+                        "movements",
+                        "techniques",
+                    )
+                }
+            }
+        return {form: self._image_url(request, f"{fake.id}-{form}")}
+
+    def _interrogation(self, request: web.Request, fake: _FakeRequest) -> dict:
+        now = time.monotonic()
+        if fake.faulted:
+            state = "faulted"
+        elif fake.done(now):
+            state = "done"
+        elif min(fake.finish_times, default=now) - self.process_time <= now:
+            state = "processing"
+        else:
+            state = "waiting"
+        return {
+            "state": state,
+            "forms": [
+                {
+                    "form": form,
+                    "state": "done" if t <= now else "waiting",
+                    "result": self._form_result(request, fake, form)
+                    if t <= now
+                    else {},
+                }
+                for form, t in zip(fake.forms, fake.finish_times)
+            ],
+        }
+
+    async def _interrogate_status(self, request: web.Request) -> web.Response:
+        fake = self._get(request, "interrogate")
+        return web.json_response(self._interrogation(request, fake))
+
+    async def _interrogate_cancel(self, request: web.Request) -> web.Response:
+        fake = self._get(request, "interrogate")
+        fake.cancelled = True
+        del self.requests[fake.id]
+        return web.json_response(self._interrogation(request, fake))
@@ -1,6 +1,5 @@
+import asyncio
 import sys
-import time
-from concurrent.futures.thread import ThreadPoolExecutor
 
 from PIL import Image
 from PySide6.QtCore import Signal
@@ -26,7 +25,10 @@ from horde_workspace.gui.clipboard import (
     copy_image_to_clipboard,
     open_file_in_default_app,
 )
-from horde_workspace.processors import generate_images
+from horde_workspace.processors.generate import GeneratedImage, async_generate_images
+from horde_workspace.processors.resume import async_resume
+from horde_workspace.ratelimit import backoff_delay
+from horde_workspace.utils import APIError, TransientAPIError
 from horde_workspace.workspace import Workspace
 
 
@@ -53,8 +55,6 @@ class WorkspaceWidget(QWidget):
         self.kudos = 0
         self.cols = 6
 
-        self.executor = ThreadPoolExecutor(10)
-
         self.signal.connect(self.on_image_generated)
 
         # Layout for the workspace
@@ -157,6 +157,14 @@ class WorkspaceWidget(QWidget):
         self.images = []
         self.refresh_images()
 
+        # Collect jobs which were still in flight when the last session ended
+        if self.workspace.journal.pending():
+            self.queue += 1
+            self.update_queue()
+            self.workspace.client.submit(self.resume_images()).add_done_callback(
+                lambda result: self.signal.emit(result)
+            )
+
     def refresh_images(self):
         while self.gallery_layout.count():
             item = self.gallery_layout.takeAt(0)
@@ -223,6 +231,7 @@ class WorkspaceWidget(QWidget):
 
     def close_tab(self):
         self.tab_widget.removeTab(self.tab_widget.currentIndex())
+        self.workspace.close()
 
     # noinspection PyMethodMayBeStatic
     def open_image(self, image_data: dict):
@@ -294,8 +303,9 @@ class WorkspaceWidget(QWidget):
         # Start future
         self.queue += 1
         self.update_queue()
-        self.executor.submit(
-            self.generate_image, job=self.job.model_copy(deep=True), attempts=3
+        # All jobs share the workspace's event loop and connection pool
+        self.workspace.client.submit(
+            self.generate_image(job=self.job.model_copy(deep=True), attempts=3)
         ).add_done_callback(lambda result: self.signal.emit(result))
 
     def update_queue(self):
@@ -310,12 +320,12 @@ class WorkspaceWidget(QWidget):
         self.update_kudos()
         self.refresh_images()
 
-    def generate_image(self, job: Job, attempts: int = 3):
-        for _ in range(attempts):
+    async def generate_image(self, job: Job, attempts: int = 3):
+        for attempt in range(attempts):
             try:
-                generation = generate_images(self.workspace, job)
-                path = self.workspace.directory / self.workspace.save(
-                    generation.get_image()
+                generation = await async_generate_images(self.workspace, job)
+                path = self.workspace.directory / await asyncio.to_thread(
+                    self.workspace.save_bytes, generation.images[0]
                 )
                 self.kudos += generation.kudos
                 self.images.append(
@@ -325,10 +335,29 @@ class WorkspaceWidget(QWidget):
                     }
                 )
                 return
-            except Exception as e:
+            except TransientAPIError as e:
+                # The request may have finished and been charged, it stays in the journal for resume_images
+                print(f"Error generating image, left for resume: {e}")
+                return
+            except APIError as e:
+                # Faulted or impossible requests are not charged, so a new submission is safe
                 print(f"Error generating image: {e}")
-                time.sleep(1)
-                continue
+                await asyncio.sleep(backoff_delay(attempt))
+
+    async def resume_images(self):
+        async for entry, image in async_resume(self.workspace):
+            if isinstance(image, GeneratedImage) and image.name is not None:
+                # Label with the job which produced the image, requests journaled without one get an empty job
+                job = entry.get("job")
+                path = self.workspace.directory / image.name
+                self.images.append(
+                    {
+                        "file": str(path.resolve()),
+                        "job": Job(prompt="")
+                        if job is None
+                        else Job.model_validate(job),
+                    }
+                )
 
     def keyPressEvent(self, event):
         if event.key() in (Qt.Key.Key_Enter, Qt.Key.Key_Return):
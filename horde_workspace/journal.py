@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Iterator
+
+from horde_workspace.utils import TransientAPIError
+
+
+class Journal:
+    """
+    Append-only JSONL log of submitted Horde requests, so in-flight requests survive a crash or restart.
+
+    Each line records a state change of a request: submitted, done, failed or cancelled.
+    Requests whose last state is submitted can be resumed later.
+
+    The pending requests are read once and then kept in memory. Finished requests are dropped from the file when it is
+    opened, and again whenever it grows past max_lines and twice the number of pending requests.
+    """
+
+    def __init__(self, path: PathLike | str, max_lines: int = 1024) -> None:
+        self.path = Path(path)
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self._pending: dict[str, dict] | None = None
+        self._lines = 0
+
+    def record(self, request_id: str, state: str, **fields) -> None:
+        entry = {"time": time.time(), "request_id": request_id, "state": state}
+        entry.update(fields)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            pending = self._load()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+            self._lines += 1
+
+            if state == "submitted":
+                pending[request_id] = entry
+            else:
+                pending.pop(request_id, None)
+
+            if self._lines > max(self.max_lines, 2 * len(pending)):
+                self._rewrite()
+
+    def entries(self) -> Iterator[dict]:
+        if not self.path.exists():
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash
+                    continue
+
+    def pending(self) -> dict[str, dict]:
+        """Returns the submission entries of all requests which did not finish yet."""
+        with self._lock:
+            return dict(self._load())
+
+    def compact(self) -> None:
+        """Rewrites the journal with only the pending requests."""
+        with self._lock:
+            self._load()
+            self._rewrite()
+
+    def _load(self) -> dict[str, dict]:
+        if self._pending is None:
+            pending = {}
+            lines = 0
+            for entry in self.entries():
+                lines += 1
+                if entry["state"] == "submitted":
+                    pending[entry["request_id"]] = entry
+                else:
+                    pending.pop(entry["request_id"], None)
+            self._pending = pending
+            self._lines = lines
+
+            if lines > len(pending):
+                self._rewrite()
+        return self._pending
+
+    def _rewrite(self) -> None:
+        assert self._pending is not None
+        tmp = self.path.with_suffix(".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            for entry in self._pending.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, self.path)
+        self._lines = len(self._pending)
+
+    @contextlib.contextmanager
+    def track(self, request_id: str, kind: str, **fields) -> Iterator[None]:
+        """
+        Records a request as submitted, then as done, failed or cancelled depending on the outcome of the block.
+
+        Transient errors leave the request pending, so it can be resumed, any other error marks it failed. A crash
+        or shutdown never reaches the block's exit, leaving it pending as well.
+        """
+        self.record(request_id, "submitted", kind=kind, **fields)
+        try:
+            yield
+        except TransientAPIError:
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # Cancelled requests are deleted on the Horde
+            self.record(request_id, "cancelled")
+            raise
+        except Exception as e:
+            # Including unexpected errors, after which the request is deleted on the Horde as well
+            self.record(request_id, "failed", error=str(e))
+            raise
+        self.record(request_id, "done")
@@ -0,0 +1,268 @@
+import contextlib
+import contextvars
+import json
+import math
+import re
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from os import PathLike
+from typing import Iterator
+
+from horde_workspace.client import RequestTiming
+from horde_workspace.utils import APIError, TransientAPIError
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+ID_PATTERN = re.compile(r"^[0-9a-f-]{16,}$|^\d+$")
+
+Labels = tuple[tuple[str, str], ...]
+
+_bound: contextvars.ContextVar["Metrics | None"] = contextvars.ContextVar(
+    "horde_metrics", default=None
+)
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    """
+    In-process registry of counters and histograms, exportable as Prometheus text or JSONL.
+
+    Use record_request as a HordeClient hook to count HTTP calls, bytes, retries and rate limits, and JobTimer to
+    time the lifecycle of generations and interrogations. On a client shared between workspaces, use the module's
+    record_request instead, which records into the metrics bound to the calling task.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counters: dict[str, dict[Labels, float]] = defaultdict(dict)
+        self.histograms: dict[str, dict[Labels, _Histogram]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counter = self.counters[name]
+            counter[key] = counter.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms[name].get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def record_request(self, timing: RequestTiming) -> None:
+        """Hook for HordeClient.hooks."""
+        route = _route(timing.url)
+        status = str(timing.status) if timing.status is not None else "error"
+        self.inc(
+            "horde_requests_total", method=timing.method, route=route, status=status
+        )
+        self.observe(
+            "horde_request_seconds", timing.elapsed, method=timing.method, route=route
+        )
+        self.inc("horde_request_bytes_total", timing.size, route=route)
+        if timing.attempt > 0:
+            self.inc("horde_request_retries_total", route=route)
+        if timing.status == 429:
+            self.inc("horde_rate_limited_total", route=route)
+
+    def bind(self) -> None:
+        """Attributes the HTTP calls of the current task, and of the tasks it starts from now on, to these metrics."""
+        _bound.set(self)
+
+    def summary(self) -> dict:
+        """Totals of all counters and count, mean and max of all histograms, across labels."""
+        with self._lock:
+            counters = {
+                name: sum(values.values()) for name, values in self.counters.items()
+            }
+            histograms = {}
+            for name, values in self.histograms.items():
+                count = sum(h.count for h in values.values())
+                total = sum(h.sum for h in values.values())
+                histograms[name] = {
+                    "count": count,
+                    "mean": total / count if count else 0.0,
+                    "max": max((h.max for h in values.values()), default=0.0),
+                }
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, values in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in values.items():
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_value(value)}"
+                    )
+
+            for name, values in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in values.items():
+                    cumulative = 0
+                    for bound, count in zip(
+                        histogram.buckets + (math.inf,), histogram.counts
+                    ):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else f"{bound:g}"
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: PathLike | str) -> None:
+        """Appends a timestamped snapshot of every series to a JSONL file."""
+        now = time.time()
+        with self._lock:
+            entries = [
+                {"time": now, "name": name, "labels": dict(labels), "value": value}
+                for name, values in self.counters.items()
+                for labels, value in values.items()
+            ] + [
+                {
+                    "time": now,
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "max": histogram.max,
+                }
+                for name, values in self.histograms.items()
+                for labels, histogram in values.items()
+            ]
+        with open(path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+
+class JobTimer:
+    """Times the lifecycle of a single request: submission, queue wait, processing and downloads."""
+
+    def __init__(self, metrics: Metrics | None, kind: str) -> None:
+        self.metrics = metrics
+        self.kind = kind
+        self.start = time.monotonic()
+        self.submitted_at: float | None = None
+        self.started_at: float | None = None
+        self.done_at: float | None = None
+
+    def submitted(self, kudos: float = 0.0) -> None:
+        self.submitted_at = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe(
+                "horde_job_submit_seconds",
+                self.submitted_at - self.start,
+                kind=self.kind,
+            )
+            self.metrics.inc("horde_job_kudos_total", kudos, kind=self.kind)
+
+    def check(self, status: dict) -> None:
+        """Notes when a status first shows a worker picked the request up, and when it is done."""
+        now = time.monotonic()
+        done = bool(status.get("done")) or status.get("state") == "done"
+        if self.started_at is None and (
+            done
+            or status.get("processing")
+            or status.get("finished")
+            or status.get("state") == "processing"
+        ):
+            self.started_at = now
+        if self.done_at is None and done:
+            self.done_at = now
+
+    def finished(self, outcome: str = "done") -> None:
+        if self.metrics is None:
+            return
+        self.metrics.inc("horde_jobs_total", kind=self.kind, outcome=outcome)
+        if self.submitted_at is not None and self.started_at is not None:
+            self.metrics.observe(
+                "horde_job_queue_seconds",
+                self.started_at - self.submitted_at,
+                kind=self.kind,
+            )
+            self.metrics.observe(
+                "horde_job_processing_seconds",
+                (self.done_at or time.monotonic()) - self.started_at,
+                kind=self.kind,
+            )
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[None]:
+        """Counts the outcome of the block, cancellation and transient errors as aborted."""
+        try:
+            yield
+        except TransientAPIError:
+            self.finished("aborted")
+            raise
+        except APIError:
+            self.finished("failed")
+            raise
+        except BaseException:
+            self.finished("aborted")
+            raise
+        self.finished()
+
+    def downloaded(self, elapsed: float, size: int) -> None:
+        if self.metrics is not None:
+            self.metrics.observe("horde_job_download_seconds", elapsed, kind=self.kind)
+            self.metrics.inc("horde_job_download_bytes_total", size, kind=self.kind)
+
+
+def record_request(timing: RequestTiming) -> None:
+    """Hook for HordeClient.hooks, recording into the metrics bound to the calling task, see Metrics.bind."""
+    metrics = _bound.get()
+    if metrics is not None:
+        metrics.record_request(timing)
+
+
+def _route(url: str) -> str:
+    """Reduces a URL to its endpoint, e.g., generate/status/{id}."""
+    path = urllib.parse.urlparse(url).path
+    segments = [s for s in path.split("/") if s]
+    if "v2" in segments:
+        segments = segments[segments.index("v2") + 1 :]
+    return "/".join("{id}" if ID_PATTERN.match(s) else s for s in segments)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
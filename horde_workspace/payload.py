@@ -0,0 +1,85 @@
+import functools
+import re
+import threading
+from collections import OrderedDict
+
+from attr import dataclass
+
+from horde_workspace.classes.model import Model
+from horde_workspace.data import EMBEDDINGS, LORAS, MODELS, SNIPPETS
+
+
+@dataclass
+class CompiledModel:
+    """The parts of a generation payload which only depend on the model."""
+
+    name: str
+    base_positive: str
+    base_negative: str
+    steps: int
+    cfg_scale: float
+    clip_skip: int
+    sampler_name: str
+    tis: list[dict]
+    loras: list[dict]
+
+
+@functools.cache
+def _snippet_pattern(names: tuple[str, ...]) -> re.Pattern:
+    return re.compile("%(" + "|".join(re.escape(name) for name in names) + ")%")
+
+
+def expand_snippets(text: str) -> str:
+    """Replaces every %name% of a known snippet in a single pass."""
+    if "%" not in text or not SNIPPETS:
+        return text
+    return _snippet_pattern(tuple(SNIPPETS)).sub(lambda m: SNIPPETS[m[1]], text)
+
+
+MAX_COMPILED = 256
+
+_compiled: OrderedDict[str, CompiledModel] = OrderedDict()
+_lock = threading.Lock()
+
+
+def compile_model(model: str | Model) -> CompiledModel:
+    """
+    Resolves and precomputes the static payload parts of a model, memoized per name or content.
+
+    Registry models are treated as immutable once compiled, call clear_compiled after editing one.
+    """
+    # Keyed by content, as copies of jobs, e.g., rebuilt from the journal, carry equal but new model objects
+    key = model if isinstance(model, str) else model.model_dump_json()
+    with _lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+
+    resolved = MODELS[model] if isinstance(model, str) else model
+    loras = [
+        (LORAS[lora] if isinstance(lora, str) else lora) for lora in resolved.base_loras
+    ]
+    tis = [(EMBEDDINGS[ti] if isinstance(ti, str) else ti) for ti in resolved.base_tis]
+    compiled = CompiledModel(
+        name=resolved.name,
+        base_positive=expand_snippets(resolved.base_positive),
+        base_negative=expand_snippets(resolved.base_negative),
+        steps=resolved.default_steps,
+        cfg_scale=resolved.default_cfg_scale,
+        clip_skip=resolved.clip_skip,
+        sampler_name=resolved.sampler,
+        tis=[ti.to_payload() for ti in tis],
+        loras=[lora.to_payload() for lora in loras],
+    )
+
+    with _lock:
+        _compiled[key] = compiled
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def clear_compiled() -> None:
+    with _lock:
+        _compiled.clear()
@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+
+class _Watch:
+    def __init__(self, fetch: Callable[[], Awaitable[dict]], interval: float) -> None:
+        self.fetch = fetch
+        self.interval = interval
+        self.results: asyncio.Queue[dict | Exception] = asyncio.Queue()
+        self.closed = False
+
+        # Checks run in the context of the watching task, e.g., to attribute them to its workspace's metrics
+        self.context = contextvars.copy_context()
+
+
+class StatusPoller:
+    """
+    Polls the status of all outstanding Horde requests from a single scheduler task.
+
+    Instead of every request checking its status once per second, checks are scheduled from the wait_time the Horde
+    reports, and every min_interval once a request is nearly due or processing. Requests without a hint back off
+    gradually. The total rate of checks is capped to max_rate plus rate_per_request for each outstanding request, so
+    the budget grows with the load but never exceeds a fixed interval loop.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+        max_rate: float | None = 5.0,
+        rate_per_request: float = 1.0,
+        wait_fraction: float = 0.5,
+        backoff: float = 1.25,
+    ) -> None:
+        """
+        :param max_interval: Longest time between two checks of the same request
+        :param max_rate: Base budget of checks per second across all requests, unlimited if None
+        :param rate_per_request: Budget added per outstanding request
+        :param wait_fraction: Fraction of the reported wait_time to wait before checking again
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_rate = max_rate
+        self.rate_per_request = rate_per_request
+        self.wait_fraction = wait_fraction
+        self.backoff = backoff
+
+        self._heap: list[tuple[float, int, _Watch]] = []
+        self._counter = itertools.count()
+        self._next_slot = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._checks: set[asyncio.Task] = set()
+        self._watching = 0
+
+    @property
+    def outstanding(self) -> int:
+        """Number of requests currently being watched."""
+        return self._watching
+
+    @property
+    def rate(self) -> float | None:
+        """Current budget of checks per second."""
+        if self.max_rate is None:
+            return None
+        return self.max_rate + self.rate_per_request * self._watching
+
+    def next_interval(self, data: dict, interval: float) -> float:
+        """Estimates how long to wait before checking a request again, given its last status."""
+        if data.get("processing") or data.get("finished"):
+            # Workers are already on it, results are imminent
+            interval = self.min_interval
+        elif "wait_time" in data:
+            # Estimates are rough, so approach the predicted due time in shrinking steps
+            interval = data["wait_time"] * self.wait_fraction
+        else:
+            interval = interval * self.backoff
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    async def watch(
+        self, fetch: Callable[[], Awaitable[dict]], delay: float | None = None
+    ) -> AsyncIterator[dict]:
+        """
+        Yields the status of a request each time it has been checked, until the caller stops iterating.
+
+        :param fetch: Coroutine factory fetching the current status
+        :param delay: Delay before the first check, defaults to min_interval
+        """
+        watch = _Watch(fetch, self.min_interval)
+        self._watching += 1
+        self._schedule(watch, self.min_interval if delay is None else delay)
+        try:
+            while True:
+                data = await watch.results.get()
+                if isinstance(data, Exception):
+                    raise data
+                yield data
+        finally:
+            watch.closed = True
+            self._watching -= 1
+
+    def _schedule(self, watch: _Watch, delay: float) -> None:
+        heapq.heappush(
+            self._heap, (time.monotonic() + delay, next(self._counter), watch)
+        )
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._heap:
+            due, _, watch = self._heap[0]
+            if watch.closed:
+                heapq.heappop(self._heap)
+                continue
+
+            # Wait until the earliest check is due and the rate budget allows it
+            now = time.monotonic()
+            start = max(due, self._next_slot)
+            if start > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), start - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            rate = self.rate
+            if rate is not None:
+                self._next_slot = now + 1.0 / rate
+            task = watch.context.run(asyncio.create_task, self._check(watch))
+            self._checks.add(task)
+            task.add_done_callback(self._checks.discard)
+
+    async def _check(self, watch: _Watch) -> None:
+        try:
+            data = await watch.fetch()
+        except Exception as e:
+            watch.results.put_nowait(e)
+            return
+
+        if not watch.closed:
+            watch.results.put_nowait(data)
+            watch.interval = self.next_interval(data, watch.interval)
+            self._schedule(watch, watch.interval)
@@ -1,11 +1,21 @@
 __all__ = [
     "generate_images",
+    "generate_many",
+    "stream_images",
     "pixelize",
+    "pixelize_many",
     "alchemist",
+    "alchemist_many",
+    "AlchemyForm",
     "nsfw",
     "interrogation",
     "caption",
     "upscale",
+    "resume",
+    "sweep",
+    "expand_sweep",
+    "KudosScheduler",
+    "Priority",
 ]
 
 from horde_workspace.processors.alchemist import (
@@ -14,6 +24,16 @@ from horde_workspace.processors.alchemist import (
     interrogation,
     caption,
     alchemist,
+    alchemist_many,
+    AlchemyForm,
+)
+from horde_workspace.processors.generate import (
+    generate_images,
+    generate_many,
+    stream_images,
 )
-from horde_workspace.processors.generate import generate_images
 from horde_workspace.processors.pixelize import pixelize
+from horde_workspace.processors.pixelize_batch import pixelize_many
+from horde_workspace.processors.resume import resume
+from horde_workspace.processors.sweep import sweep, expand_sweep
+from horde_workspace.processors.scheduler import KudosScheduler, Priority
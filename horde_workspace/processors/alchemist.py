@@ -1,17 +1,24 @@
 import asyncio
+import contextlib
 import io
+import logging
+import time
+from typing import AsyncIterator, Iterable, Iterator
 
 import aiohttp
 from PIL import Image
 from attr import dataclass
 from pydantic import BaseModel
 
-from horde_workspace.processors.generate import request, APIError
+from horde_workspace.metrics import JobTimer
 from horde_workspace.utils import (
+    APIError,
+    TransientAPIError,
     download_image,
-    b64_encode_image,
     GenerationError,
     assert_none,
+    payload_hash,
+    map_bounded,
 )
 from horde_workspace.workspace import Workspace
 
@@ -36,6 +43,13 @@ class InterrogationDetails(BaseModel):
     techniques: list[InterrogationResultItem]
 
 
+class AlchemyForm:
+    CAPTION = "caption"
+    NSFW = "nsfw"
+    INTERROGATION = "interrogation"
+    UPSCALE = "NMKD_Siax"
+
+
 @dataclass
 class AlchemyGeneration:
     image: bytes | None = None
@@ -50,89 +64,221 @@ class AlchemyGeneration:
 
 
 def caption(ws: Workspace, image: Image.Image) -> str:
-    return assert_none(alchemist(ws, image, ["caption"]).caption)
+    return assert_none(alchemist(ws, image, [AlchemyForm.CAPTION]).caption)
 
 
 def interrogation(ws: Workspace, image: Image.Image) -> InterrogationDetails:
-    return assert_none(alchemist(ws, image, ["interrogation"]).interrogation)
+    return assert_none(alchemist(ws, image, [AlchemyForm.INTERROGATION]).interrogation)
 
 
 def nsfw(ws: Workspace, image: Image.Image) -> bool:
-    return assert_none(alchemist(ws, image, ["nsfw"]).nsfw)
+    return assert_none(alchemist(ws, image, [AlchemyForm.NSFW]).nsfw)
 
 
 def upscale(ws: Workspace, image: Image.Image) -> Image.Image:
-    return alchemist(ws, image, ["NMKD_Siax"]).get_image()
+    return alchemist(ws, image, [AlchemyForm.UPSCALE]).get_image()
 
 
 def alchemist(ws: Workspace, image: Image.Image, forms: list[str]) -> AlchemyGeneration:
-    return asyncio.run(async_alchemist(ws, image, forms))
+    """
+    Runs all given forms on an image in a single interrogation.
+
+    Prefer declaring every analysis an image needs at once, e.g., caption, nsfw and upscale, over calling the
+    single-form helpers one by one, as the image is then only encoded, uploaded and queued once.
+    """
+    return ws.client.run(async_alchemist(ws, image, forms))
+
+
+def alchemist_many(
+    ws: Workspace,
+    images: Iterable[Image.Image],
+    forms: list[str],
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> Iterator[tuple[Image.Image, AlchemyGeneration | Exception]]:
+    """Synchronous version of async_alchemist_many, yielding results in completion order."""
+    return ws.client.iterate(
+        async_alchemist_many(ws, images, forms, max_in_flight, return_exceptions)
+    )
+
+
+async def async_alchemist_many(
+    ws: Workspace,
+    images: Iterable[Image.Image],
+    forms: list[str],
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> AsyncIterator[tuple[Image.Image, AlchemyGeneration | Exception]]:
+    """
+    Runs the same forms on many images concurrently, with one interrogation per image.
+
+    All interrogations share the client's poller. Yields (image, alchemy) pairs as they complete.
+    """
+    async for image, result in map_bounded(
+        lambda image: async_alchemist(ws, image, forms),
+        images,
+        max_in_flight,
+        return_exceptions,
+    ):
+        yield image, result
 
 
 async def async_alchemist(
     ws: Workspace, image: Image.Image, forms: list[str], timeout: int = 1000
 ) -> AlchemyGeneration:
+    # Encoding is CPU bound, keep it off the loop so concurrent interrogations keep polling
+    source_image = await asyncio.to_thread(ws.encoder.encode, image)
+
+    # Results only depend on the image and the requested forms
+    key = payload_hash({"source_image": source_image, "forms": sorted(forms)})
+    cached = await asyncio.to_thread(ws.cache.get, key)
+    if cached is not None:
+        data, blobs = cached
+        return AlchemyGeneration(
+            image=blobs[0] if blobs else None,
+            caption=data["caption"],
+            nsfw=data["nsfw"],
+            interrogation=InterrogationDetails(**data["interrogation"])
+            if data["interrogation"] is not None
+            else None,
+        )
+
+    async def interrogate() -> AlchemyGeneration:
+        alchemy = await async_alchemist_payload(ws, source_image, forms, timeout)
+        await asyncio.to_thread(
+            ws.cache.put,
+            key,
+            {
+                "caption": alchemy.caption,
+                "nsfw": alchemy.nsfw,
+                "interrogation": alchemy.interrogation.model_dump()
+                if alchemy.interrogation is not None
+                else None,
+            },
+            [alchemy.image] if alchemy.image is not None else [],
+        )
+        return alchemy
+
+    return await ws.cache.dedupe(key, interrogate)
+
+
+async def async_alchemist_payload(
+    ws: Workspace, source_image: str, forms: list[str], timeout: int = 1000
+) -> AlchemyGeneration:
+    """Submits an already encoded image for the given forms and collects the results."""
+    ws.metrics.bind()
     payload = dict(
         apikey=ws.apikey,
         slow_workers=ws.slow_workers,
-        source_image=b64_encode_image(image),
+        source_image=source_image,
         forms=[{"name": form} for form in forms],
     )
 
-    headers = {
-        "apikey": ws.apikey,
-        "Client-Agent": "horde-workspace:0:https://github.com/Luke100000/horde-workspace",
-        "Content-Type": "application/json",
-    }
-
-    async with aiohttp.ClientSession() as session:
-        # Get the UUID from the generation response
-        response_data = await request(
-            session.post,
-            "https://stablehorde.net/api/v2/interrogate/async",
-            headers,
-            payload,
-        )
-        request_id = response_data.get("id")
-        if not request_id:
-            raise APIError("No request ID found in the response")
-
-        # Poll
-        url_status = f"https://stablehorde.net/api/v2/interrogate/status/{request_id}"
-        for _ in range(timeout):
-            status_data = await request(session.get, url_status, headers)
-
-            # Check if the request is completed
-            if status_data["state"] == "done":
-                forms_by_type = {}
-                for form in status_data["forms"]:
-                    if form["state"] == "done":
-                        if form["form"] in ("caption", "nsfw", "interrogation"):
-                            forms_by_type[form["form"]] = form["result"]
-                        else:
-                            forms_by_type["upscale"] = form["result"][form["form"]]
-
-                return AlchemyGeneration(
-                    image=await download_image(session, forms_by_type["upscale"])
-                    if "upscale" in forms_by_type
-                    else None,
-                    caption=forms_by_type["caption"]["caption"]
-                    if "caption" in forms_by_type
-                    else None,
-                    nsfw=forms_by_type["nsfw"]["nsfw"]
-                    if "nsfw" in forms_by_type
-                    else None,
-                    interrogation=InterrogationDetails(
-                        **forms_by_type["interrogation"]["interrogation"]
+    headers = ws.client.headers(ws.apikey)
+    timer = JobTimer(ws.metrics, "interrogate")
+
+    # Get the UUID from the generation response
+    response_data = await ws.client.request(
+        "POST",
+        ws.client.url("interrogate/async"),
+        headers,
+        payload,
+    )
+    request_id = response_data.get("id")
+    if not request_id:
+        raise APIError("No request ID found in the response")
+    timer.submitted(response_data.get("kudos", 0))
+
+    with (
+        timer.track(),
+        ws.journal.track(
+            request_id, "interrogate", payload_hash=payload_hash(payload), forms=forms
+        ),
+    ):
+        return await async_collect_alchemy(ws, request_id, timeout, timer)
+
+
+async def async_collect_alchemy(
+    ws: Workspace,
+    request_id: str,
+    timeout: int = 1000,
+    timer: JobTimer | None = None,
+) -> AlchemyGeneration:
+    """
+    Waits for an already submitted interrogation and fetches its results.
+
+    Transient failures resume polling the same request instead of failing, so a job is never submitted twice.
+    Unless it finished, the request is deleted on the Horde when the deadline passes, it fails, or it is cancelled.
+    """
+    session = ws.client.session
+    headers = ws.client.headers(ws.apikey)
+    deadline = time.monotonic() + timeout
+    url_status = ws.client.url(f"interrogate/status/{request_id}")
+
+    status_data = {"state": "waiting"}
+    finished = False
+    try:
+        while True:
+            try:
+                # Poll, the poller spaces out checks across all outstanding requests
+                async with contextlib.aclosing(
+                    ws.client.poller.watch(
+                        lambda: ws.client.request(
+                            "GET", url_status, headers, timeout=ws.client.poll_timeout
+                        )
                     )
-                    if "interrogation" in forms_by_type
-                    else None,
-                )
-            elif status_data["state"] == "faulted":
-                raise APIError("Request faulted")
+                ) as checks:
+                    async for status_data in checks:
+                        if timer is not None:
+                            timer.check(status_data)
+
+                        # Check if the request is completed
+                        if status_data["state"] == "done":
+                            break
+                        elif status_data["state"] == "faulted":
+                            raise APIError("Request faulted")
+                        elif time.monotonic() > deadline:
+                            break
 
-            await asyncio.sleep(1)
+                if status_data["state"] == "done":
+                    finished = True
+                    forms_by_type = {}
+                    for form in status_data["forms"]:
+                        if form["state"] == "done":
+                            if form["form"] in ("caption", "nsfw", "interrogation"):
+                                forms_by_type[form["form"]] = form["result"]
+                            else:
+                                forms_by_type["upscale"] = form["result"][form["form"]]
+
+                    image = None
+                    if "upscale" in forms_by_type:
+                        start = time.monotonic()
+                        image = await download_image(session, forms_by_type["upscale"])
+                        if timer is not None:
+                            timer.downloaded(time.monotonic() - start, len(image))
+
+                    return AlchemyGeneration(
+                        image=image,
+                        caption=forms_by_type["caption"]["caption"]
+                        if "caption" in forms_by_type
+                        else None,
+                        nsfw=forms_by_type["nsfw"]["nsfw"]
+                        if "nsfw" in forms_by_type
+                        else None,
+                        interrogation=InterrogationDetails(
+                            **forms_by_type["interrogation"]["interrogation"]
+                        )
+                        if "interrogation" in forms_by_type
+                        else None,
+                    )
+                break
+            except (TransientAPIError, aiohttp.ClientError) as e:
+                if time.monotonic() > deadline:
+                    raise
+                logging.warning("Resuming request %s after error: %s", request_id, e)
 
-        # Cancel on timeout
-        await request(session.delete, url_status, headers)
         raise APIError("Timeout")
+    finally:
+        if not finished:
+            # Covers timeouts, faults and cancellation
+            await ws.client.cancel(url_status, headers)
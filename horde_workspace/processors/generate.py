@@ -1,14 +1,28 @@
 import asyncio
+import contextlib
 import io
 import logging
+import time
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
 
 import aiohttp
 from PIL import Image
 from attr import dataclass
 
 from horde_workspace.classes.job import Job
-from horde_workspace.data import MODELS, LORAS, EMBEDDINGS, SNIPPETS
-from horde_workspace.utils import b64_encode_image, GenerationError, download_image
+from horde_workspace.client import HordeClient
+from horde_workspace.metrics import JobTimer
+from horde_workspace.payload import compile_model, expand_snippets
+from horde_workspace.utils import (
+    APIError,
+    GenerationError,
+    TransientAPIError,
+    download_image,
+    download_to_file,
+    map_bounded,
+    payload_hash,
+)
 from horde_workspace.workspace import Workspace
 
 try:
@@ -17,10 +31,6 @@ except AttributeError:
     pass
 
 
-class APIError(Exception):
-    pass
-
-
 @dataclass
 class Generation:
     uuids: list[str] = []
@@ -36,23 +46,244 @@ class Generation:
         return Image.open(io.BytesIO(self.images[0]))
 
 
+@dataclass
+class GeneratedImage:
+    uuid: str
+    seed: str
+    image: bytes | None = None
+    name: str | None = None
+    path: Path | None = None
+    sha256: str | None = None
+
+    def get_image(self) -> Image.Image:
+        if self.image is None:
+            if self.path is None:
+                raise GenerationError("No image available")
+            return Image.open(self.path)
+        return Image.open(io.BytesIO(self.image))
+
+
 def generate_images(ws: Workspace, job: Job) -> Generation:
-    return asyncio.run(async_generate_images(ws, job))
+    return ws.client.run(async_generate_images(ws, job))
+
+
+def generate_many(
+    ws: Workspace,
+    jobs: Iterable[Job],
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> Iterator[tuple[Job, Generation | Exception]]:
+    """Synchronous version of async_generate_many, yielding results in completion order."""
+    return ws.client.iterate(
+        async_generate_many(ws, jobs, max_in_flight, return_exceptions)
+    )
+
+
+async def async_generate_many(
+    ws: Workspace,
+    jobs: Iterable[Job],
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> AsyncIterator[tuple[Job, Generation | Exception]]:
+    """
+    Generates many jobs concurrently on the running event loop.
+
+    Jobs are pulled lazily from the iterable, at most max_in_flight of them are in flight at once.
+    Yields (job, generation) pairs as they complete. If return_exceptions is set, failed jobs yield their
+    exception instead of aborting the batch.
+    """
+    async for job, result in map_bounded(
+        lambda job: async_generate_images(ws, job),
+        jobs,
+        max_in_flight,
+        return_exceptions,
+    ):
+        yield job, result
 
 
 async def async_generate_images(ws: Workspace, job: Job) -> Generation:
-    model = MODELS[job.model] if isinstance(job.model, str) else job.model
-    loras = job.loras + [
-        (LORAS[lora] if isinstance(lora, str) else lora) for lora in model.base_loras
-    ]
-    tis = job.tis + [
-        (EMBEDDINGS[ti] if isinstance(ti, str) else ti) for ti in model.base_tis
-    ]
+    ws.metrics.bind()
+    payload = await async_build_payload(ws, job)
+    if job.seed is None:
+        # Without a fixed seed every submission is expected to yield new images
+        return await async_generate_payload(ws, payload, job)
+
+    # Identical seeded payloads produce identical images, reuse them instead of paying again
+    key = payload_hash(payload)
+    cached = await asyncio.to_thread(ws.cache.get, key)
+    if cached is not None:
+        data, images = cached
+        return Generation(uuids=data["uuids"], images=images, kudos=0)
+
+    async def generate() -> Generation:
+        generation = await async_generate_payload(ws, payload, job)
+        await asyncio.to_thread(
+            ws.cache.put, key, {"uuids": generation.uuids}, generation.images
+        )
+        return generation
+
+    return await ws.cache.dedupe(key, generate)
+
+
+async def async_generate_payload(
+    ws: Workspace, payload: dict, job: Job | None = None
+) -> Generation:
+    """
+    Submits an already built payload, collects its images and accounts its kudos.
+
+    :param job: The job the payload was built from, recorded in the journal
+    """
+    ws.metrics.bind()
+    start = time.monotonic()
+    timer = JobTimer(ws.metrics, "generate")
+    request_id, kudos = await async_submit(ws.client, payload, ws.apikey)
+    timer.submitted(kudos)
+    with (
+        timer.track(),
+        ws.journal.track(
+            request_id,
+            "generate",
+            payload_hash=payload_hash(payload),
+            kudos=kudos,
+            job=journal_job(job),
+        ),
+    ):
+        generation = await async_collect_images(
+            ws.client, request_id, ws.apikey, kudos, timer=timer
+        )
+
+    if ws.router is not None:
+        params = payload["params"]
+        ws.router.observe(
+            payload["models"][0],
+            params["width"] * params["height"],
+            time.monotonic() - start,
+        )
+
+    ws.add_kudos(int(generation.kudos))
+
+    return generation
+
+
+def stream_images(
+    ws: Workspace, job: Job, save: bool = True
+) -> Iterator[GeneratedImage]:
+    """Synchronous version of async_stream_images."""
+    return ws.client.iterate(async_stream_images(ws, job, save))
+
+
+async def async_stream_images(
+    ws: Workspace, job: Job, save: bool = True
+) -> AsyncIterator[GeneratedImage]:
+    """
+    Generates a job, yielding each image as soon as its worker finished it instead of waiting for the whole batch.
+
+    :param save: Whether to stream each image straight into the workspace instead of keeping its bytes in memory
+    """
+    ws.metrics.bind()
+    payload = await async_build_payload(ws, job)
+    timer = JobTimer(ws.metrics, "generate")
+    request_id, kudos = await async_submit(ws.client, payload, ws.apikey)
+    timer.submitted(kudos)
+    ws.add_kudos(kudos)
+
+    with (
+        timer.track(),
+        ws.journal.track(
+            request_id,
+            "generate",
+            payload_hash=payload_hash(payload),
+            kudos=kudos,
+            job=journal_job(job),
+        ),
+    ):
+        async with contextlib.aclosing(
+            async_stream_request(ws, request_id, save, timer=timer)
+        ) as images:
+            async for image in images:
+                yield image
+
+
+async def async_stream_request(
+    ws: Workspace,
+    request_id: str,
+    save: bool = True,
+    timeout: int = 1000,
+    timer: JobTimer | None = None,
+) -> AsyncIterator[GeneratedImage]:
+    """
+    Yields the images of an already submitted generation as soon as they are finished.
+
+    A failed download does not abort the stream, which would delete the request on the Horde. Instead, the remaining
+    images are still collected and a TransientAPIError is raised at the end, leaving the request to be resumed.
+    """
+    count = 0
+    failed = 0
+    async with contextlib.aclosing(
+        async_stream_generations(ws.client, request_id, ws.apikey, timeout, timer)
+    ) as generations:
+        async for gen in generations:
+            if gen["censored"]:
+                continue
+
+            image = GeneratedImage(uuid=gen["id"], seed=str(gen.get("seed", "")))
+            start = time.monotonic()
+            try:
+                if save:
+                    # The Horde's WebP bytes are stored verbatim, without decoding and re-encoding
+                    image.name = f"{image.uuid}.webp"
+                    image.path = ws.directory / image.name
+                    image.sha256 = await download_to_file(
+                        ws.client.session, gen["img"], image.path
+                    )
+                else:
+                    image.image = await download_image(ws.client.session, gen["img"])
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning("Could not download image %s: %s", image.uuid, e)
+                failed += 1
+                continue
+            if timer is not None:
+                size = image.path.stat().st_size if image.path else len(image.image)
+                timer.downloaded(time.monotonic() - start, size)
+            count += 1
+            yield image
+
+    if failed:
+        raise TransientAPIError(f"Could not download {failed} images of {request_id}")
+    if not count:
+        raise APIError("No images generated")
+
+
+async def async_build_payload(ws: Workspace, job: Job) -> dict:
+    """Builds the payload of a job, routed to the best served model and workers if the workspace has a router."""
+    if ws.router is None:
+        return build_payload(ws, job)
+
+    route = await ws.router.route(job, ws.trusted_workers)
+    payload = build_payload(ws, route.job)
+    if route.workers is not None and not ws.workers:
+        payload["workers"] = route.workers
+    if route.slow_workers is not None:
+        payload["slow_workers"] = route.slow_workers
+    if route.trusted_workers is not None:
+        payload["trusted_workers"] = route.trusted_workers
+    return payload
+
+
+def journal_job(job: Job | None) -> dict | None:
+    """The job as JSON, so resumed requests know what produced them. Source images are not kept."""
+    if job is None:
+        return None
+    return job.model_dump(mode="json", exclude={"source_image"})
+
+
+def build_payload(ws: Workspace, job: Job) -> dict:
+    model = compile_model(job.model)
 
     # Dynamic kwargs to make API happy
     kwargs = {}
     if job.source_image is not None:
-        kwargs["source_image"] = b64_encode_image(job.source_image)
+        kwargs["source_image"] = ws.encoder.encode(job.source_image)
         kwargs["source_processing"] = "img2img"
 
     if ws.workers:
@@ -74,12 +305,8 @@ async def async_generate_images(ws: Workspace, job: Job) -> Generation:
         width = job.size.width
         height = job.size.height
 
-    # Construct prompt
-    prompt = f"{model.base_positive}, {job.prompt} ### {job.negprompt}, {model.base_negative}"
-
-    # Apply snippets
-    for name, value in SNIPPETS.items():
-        prompt = prompt.replace("%" + name + "%", value)
+    # Construct prompt, the model's base prompts are already expanded
+    prompt = f"{model.base_positive}, {expand_snippets(job.prompt)} ### {expand_snippets(job.negprompt)}, {model.base_negative}"
 
     if "%" in prompt:
         logging.warning("Unresolved snippet in prompt: %s", prompt)
@@ -94,17 +321,15 @@ async def async_generate_images(ws: Workspace, job: Job) -> Generation:
         models=[model.name],
         **kwargs,
         params=dict(
-            steps=model.default_steps if job.steps is None else job.steps,
-            cfg_scale=model.default_cfg_scale
-            if job.cfg_scale is None
-            else job.cfg_scale,
+            steps=model.steps if job.steps is None else job.steps,
+            cfg_scale=model.cfg_scale if job.cfg_scale is None else job.cfg_scale,
             clip_skip=model.clip_skip,
             denoising_strength=job.denoising_strength,
-            sampler_name=model.sampler,
+            sampler_name=model.sampler_name,
             height=height,
             width=width,
-            tis=[ti.to_payload() for ti in tis],
-            loras=[lora.to_payload() for lora in loras],
+            tis=[ti.to_payload() for ti in job.tis] + model.tis,
+            loras=[lora.to_payload() for lora in job.loras] + model.loras,
             n=job.n,
             transparent=job.transparent,
             hires_fix=job.hires,
@@ -112,111 +337,173 @@ async def async_generate_images(ws: Workspace, job: Job) -> Generation:
         ),
     )
 
-    generation = await async_generate_images_inner(payload, ws.apikey)
+    return payload
 
-    ws.add_kudos(int(generation.kudos))
-
-    return generation
 
+async def async_generate_images_inner(
+    client: HordeClient, payload: dict, apikey: str, timeout: int = 1000
+) -> Generation:
+    request_id, kudos = await async_submit(client, payload, apikey)
+    return await async_collect_images(client, request_id, apikey, kudos, timeout)
+
+
+async def async_submit(
+    client: HordeClient, payload: dict, apikey: str
+) -> tuple[str, int]:
+    """Submits a generation and returns its request ID and kudos cost."""
+    response_data = await client.request(
+        "POST",
+        client.url("generate/async"),
+        client.headers(apikey),
+        payload,
+    )
+    request_id = response_data.get("id")
+    if not request_id:
+        raise APIError("No request ID found in the response")
+
+    if "warnings" in response_data:
+        for warning in response_data["warnings"]:
+            logging.warning(warning)
+
+    return request_id, int(response_data["kudos"])
+
+
+async def async_estimate_kudos(
+    client: HordeClient, payload: dict, apikey: str
+) -> float:
+    """Asks the Horde for the kudos cost of a payload without submitting it."""
+    response_data = await client.request(
+        "POST",
+        client.url("generate/async"),
+        client.headers(apikey),
+        {**payload, "dry_run": True},
+    )
+    return float(response_data["kudos"])
 
-async def request(func, url: str, headers: dict, payload: dict | None = None) -> dict:
-    while True:
-        try:
-            async with func(url, json=payload, headers=headers) as response:
-                if response.status == 429:
-                    logging.info("Rate limited, waiting 1s")
-                    await asyncio.sleep(1)
-                    continue
-                if response.status not in [200, 202]:
-                    raise APIError(
-                        f"Error during request {url}: {response.status}, {await response.text()}"
-                    )
-
-                response_data = await response.json()
-                logging.debug(
-                    "Response from %s %s: %s", func.__name__, url, response_data
-                )
 
-                return response_data
-        except (aiohttp.ClientError, Exception) as e:
-            raise APIError(e)
+async def async_collect_images(
+    client: HordeClient,
+    request_id: str,
+    apikey: str,
+    kudos: int = 0,
+    timeout: int = 1000,
+    timer: JobTimer | None = None,
+) -> Generation:
+    """Waits for an already submitted generation and downloads its images, each as soon as it is finished."""
+
+    async def download(url: str) -> bytes:
+        start = time.monotonic()
+        data = await download_image(client.session, url)
+        if timer is not None:
+            timer.downloaded(time.monotonic() - start, len(data))
+        return data
+
+    uuids = []
+    tasks = []
+    try:
+        async with contextlib.aclosing(
+            async_stream_generations(client, request_id, apikey, timeout, timer)
+        ) as generations:
+            async for gen in generations:
+                if not gen["censored"]:
+                    uuids.append(gen["id"])
+                    tasks.append(asyncio.create_task(download(gen["img"])))
+
+        if not tasks:
+            raise APIError("No images generated")
+
+        # noinspection PyTypeChecker
+        images: list[bytes] = await asyncio.gather(*tasks)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # The request finished on the Horde, so it can still be resumed
+        raise TransientAPIError(
+            f"Could not download images of {request_id}: {e}"
+        ) from e
+    finally:
+        # Downloads still running when the stream or another download failed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return Generation(
+        uuids=uuids,
+        images=images,
+        kudos=kudos,
+    )
 
 
-async def async_generate_images_inner(
-    payload: dict, apikey: str, timeout: int = 1000
-) -> Generation:
-    headers = {
-        "apikey": apikey,
-        "Client-Agent": "horde-workspace:0:https://github.com/Luke100000/horde-workspace",
-        "Content-Type": "application/json",
-    }
-
-    async with aiohttp.ClientSession() as session:
-        # Get the UUID from the generation response
-        response_data = await request(
-            session.post,
-            "https://stablehorde.net/api/v2/generate/async",
-            headers,
-            payload,
-        )
-        request_id = response_data.get("id")
-        if not request_id:
-            raise APIError("No request ID found in the response")
-
-        if "warnings" in response_data:
-            for warning in response_data["warnings"]:
-                logging.warning(warning)
-
-        # Poll
-        done = False
-        not_possible = False
-        url_check = f"https://stablehorde.net/api/v2/generate/check/{request_id}"
-        for _ in range(timeout):
-            check_data = await request(session.get, url_check, headers)
-
-            # Check if the request is completed
-            if check_data.get("done"):
-                done = True
-                break
-            elif not check_data.get("is_possible"):
-                logging.debug("Not possible: %s", payload)
-                not_possible = True
+async def async_stream_generations(
+    client: HordeClient,
+    request_id: str,
+    apikey: str,
+    timeout: int = 1000,
+    timer: JobTimer | None = None,
+) -> AsyncIterator[dict]:
+    """
+    Yields the generations of an already submitted request as soon as workers finish them, including censored ones.
+
+    Transient failures resume polling the same request instead of failing, so a job is never submitted twice.
+    Unless it finished, the request is deleted on the Horde when the deadline passes, it fails, or the stream is
+    cancelled or closed early.
+    """
+    headers = client.headers(apikey)
+    deadline = time.monotonic() + timeout
+    url_check = client.url(f"generate/check/{request_id}")
+    url_status = client.url(f"generate/status/{request_id}")
+
+    seen = set()
+    not_possible = False
+    finished = False
+    try:
+        while True:
+            try:
+                # Poll, the poller spaces out checks across all outstanding requests
+                async with contextlib.aclosing(
+                    client.poller.watch(
+                        lambda: client.request(
+                            "GET", url_check, headers, timeout=client.poll_timeout
+                        )
+                    )
+                ) as checks:
+                    async for check_data in checks:
+                        if timer is not None:
+                            timer.check(check_data)
+
+                        # Fetch whenever workers finished more images than we have seen
+                        done = check_data.get("done")
+                        if done or check_data.get("finished", 0) > len(seen):
+                            status_data = await client.request(
+                                "GET", url_status, headers, timeout=client.poll_timeout
+                            )
+                            for gen in status_data.get("generations", []):
+                                if gen["id"] not in seen:
+                                    seen.add(gen["id"])
+                                    yield gen
+
+                        # Check if the request is completed
+                        if done:
+                            finished = True
+                            return
+                        elif not check_data.get("is_possible"):
+                            logging.debug("Not possible: %s", request_id)
+                            not_possible = True
+                            break
+                        elif check_data.get("faulted"):
+                            raise APIError("Request faulted")
+                        elif time.monotonic() > deadline:
+                            break
+                        else:
+                            logging.debug(
+                                f"{check_data.get('wait_time', 0)}s remaining, {check_data} processing."
+                            )
                 break
-            elif check_data.get("faulted"):
-                raise APIError("Request faulted")
-            else:
-                logging.debug(
-                    f"{response_data.get('wait_time', 0)}s remaining, {response_data} processing."
-                )
-
-            await asyncio.sleep(1)
-
-        # Fetch
-        url_status = f"https://stablehorde.net/api/v2/generate/status/{request_id}"
-        if done:
-            check_data = await request(session.get, url_status, headers)
-            valid_gens = [
-                gen for gen in check_data.get("generations", []) if not gen["censored"]
-            ]
-
-            if not valid_gens:
-                raise APIError("No images generated")
-
-            tasks = [
-                asyncio.create_task(download_image(session, gen["img"]))
-                for gen in valid_gens
-            ]
-            uuids = [gen["id"] for gen in valid_gens]
-
-            # noinspection PyTypeChecker
-            images: list[bytes] = await asyncio.gather(*tasks)
-
-            return Generation(
-                uuids=uuids,
-                images=images,
-                kudos=int(response_data["kudos"]),
-            )
-
-        # Cancel on timeout
-        await request(session.delete, url_status, headers)
+            except TransientAPIError as e:
+                if time.monotonic() > deadline:
+                    raise
+                logging.warning("Resuming request %s after error: %s", request_id, e)
+
         raise APIError("Not Possible") if not_possible else APIError("Timeout")
+    finally:
+        if not finished:
+            # Covers timeouts, faults, cancellation and consumers abandoning the stream early
+            await client.cancel(url_status, headers)
@@ -1,14 +1,17 @@
+import heapq
 import io
 
 import numpy as np
 from PIL import Image
+from scipy import ndimage
 from scipy.spatial.distance import pdist, squareform, cdist
 from skimage.color import rgb2gray, rgb2lab
 from skimage.filters import sobel
 from skimage.segmentation import slic
 from skimage.segmentation import watershed
 from skimage.util import view_as_blocks
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin
 
 
 def image_to_np(image: Image.Image) -> np.ndarray:
@@ -35,8 +38,24 @@ def downscale(image: np.ndarray, factor: int = 8) -> np.ndarray:
 
 
 def merge_clusters(
-    clusters: np.ndarray, min_distance: float, max_count: int = 256
+    clusters: np.ndarray,
+    min_distance: float,
+    max_count: int = 256,
+    algorithm: str = "sorted",
 ) -> np.ndarray:
+    """
+    Repeatedly merges the closest two clusters while they are closer than min_distance or there are too many.
+
+    Distances are those of the initial clusters, a merged cluster keeps the distances of the lower index.
+
+    :param algorithm: "sorted" visits the pairs in distance order once, "naive" searches the whole distance matrix
+        after every merge. Both yield identical results.
+    """
+    if algorithm == "sorted":
+        return _merge_clusters_sorted(clusters, min_distance, max_count)
+    elif algorithm != "naive":
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+
     # Compute pairwise distances
     distances = squareform(pdist(clusters))
     np.fill_diagonal(distances, np.inf)
@@ -53,40 +72,113 @@ def merge_clusters(
             return clusters
 
 
+def _merge_clusters_sorted(
+    clusters: np.ndarray, min_distance: float, max_count: int
+) -> np.ndarray:
+    clusters = clusters.copy()
+    count = clusters.shape[0]
+    if count < 2:
+        return clusters
+
+    # Distances never change, so the pairs can be visited in the order the naive search would pick them
+    distances = pdist(clusters)
+    rows, cols = np.triu_indices(count, k=1)
+    order = np.argsort(distances, kind="stable")
+
+    alive = np.ones(count, dtype=bool)
+    for pair in order:
+        if distances[pair] >= min_distance and count <= max_count:
+            break
+        a, b = rows[pair], cols[pair]
+        if alive[a] and alive[b]:
+            clusters[a, :] = (clusters[a, :] + clusters[b, :]) / 2
+            alive[b] = False
+            count -= 1
+
+    return clusters[alive]
+
+
 def fix_palette(
     image: np.ndarray,
     min_distance: float = 6.0,
     max_count: int = 256,
     initial_count: int = 256,
+    algorithm: str = "kmeans",
+    sample_size: int = 8192,
 ) -> np.ndarray:
     """
     Performs one KMeans clustering step on the image in CIE Lab color space to generate a possible palette,
     then performs a second step with a subset of colors constrained by the minimum distance.
+
+    :param algorithm: "kmeans" clusters every pixel, "minibatch" fits MiniBatchKMeans on a random sample of pixels
+        and assigns every pixel to its nearest center afterwards
+    :param sample_size: Pixels sampled by "minibatch", trading quality for speed
     """
     alpha = image[:, :, 3].reshape(-1, 1)
     color = rgb2lab(image[:, :, :3]).reshape((-1, 3))
     data = np.concatenate([color, alpha], axis=1)
 
-    # Find initial clusters
-    k = KMeans(initial_count, random_state=42)
-    k.fit(data)
-    centers = k.cluster_centers_
+    if algorithm == "kmeans":
+        # Find initial clusters
+        k = KMeans(initial_count, random_state=42)
+        k.fit(data)
+        centers = k.cluster_centers_
+
+        # Merge clusters that are too close
+        centers = merge_clusters(centers, min_distance, max_count)
+
+        # Find final clusters
+        clusters = KMeans(
+            centers.shape[0],
+            init=centers,  # pyright: ignore [reportArgumentType]
+            random_state=42,
+        ).fit_predict(data)
+    elif algorithm == "minibatch":
+        sample = data
+        if data.shape[0] > sample_size:
+            rng = np.random.default_rng(42)
+            sample = data[rng.choice(data.shape[0], sample_size, replace=False)]
+
+        # Find initial clusters
+        k = MiniBatchKMeans(min(initial_count, sample.shape[0]), random_state=42)
+        k.fit(sample)
+        centers = k.cluster_centers_
+
+        # Merge clusters that are too close
+        centers = merge_clusters(centers, min_distance, max_count)
+
+        # Refine the merged clusters, then assign every pixel
+        k = MiniBatchKMeans(centers.shape[0], init=centers, n_init=1, random_state=42)
+        k.fit(sample)
+        clusters = pairwise_distances_argmin(data, k.cluster_centers_)
+    else:
+        raise ValueError(f"Unknown algorithm: {algorithm}")
 
-    # Merge clusters that are too close
-    centers = merge_clusters(centers, min_distance, max_count)
+    # Every pixel takes the median color of its cluster
+    medians = grouped_median(image.reshape((-1, image.shape[2])), clusters)
+    return medians[clusters].reshape(image.shape)
 
-    # Find final clusters
-    clusters = KMeans(centers.shape[0], init=centers, random_state=42).fit_predict(data)  # pyright: ignore [reportArgumentType]
-    clusters = clusters.reshape(image.shape[:2])
 
-    new_image = np.zeros_like(image)
-    for i in range(max_count):
-        mask = clusters == i
-        if mask.sum() > 0:
-            new_color = np.median(image[mask], axis=0)
-            new_image[mask] = new_color
+def grouped_median(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """
+    Computes the per-channel median of the values of each group in one sorted pass, like np.median per group.
 
-    return new_image
+    :param values: Values of shape (n, channels)
+    :param groups: Non-negative group index per value
+    :return: Medians of shape (groups.max() + 1, channels), zero for empty groups
+    """
+    counts = np.bincount(groups)
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+    lower = (starts + (counts - 1) // 2)[present]
+    upper = (starts + counts // 2)[present]
+
+    medians = np.zeros((counts.shape[0], values.shape[1]), dtype=values.dtype)
+    for c in range(values.shape[1]):
+        # Sorted by group, then value
+        column = values[np.lexsort((values[:, c], groups)), c]
+        medians[present, c] = (column[lower] + column[upper]) / 2
+    return medians
 
 
 def make_seamless(
@@ -103,7 +195,15 @@ def make_seamless(
     if axis is None:
         for axis in [0, 1]:
             image = make_seamless(
-                image, algorithm, axis, blend, compactness, n_segments
+                image,
+                algorithm,
+                axis,
+                blend,
+                compactness,
+                n_segments,
+                threshold,
+                dither_mask,
+                debug,
             )
         return image
 
@@ -132,17 +232,12 @@ def make_seamless(
     else:
         raise ValueError(f"Unknown algorithm: {algorithm}")
 
-    # Separate clusters into two groups
-    mask = np.zeros_like(clusters)
-    for i in range(clusters.max() + 1):
-        m = clusters == i
-        if (
-            m.sum() > 0
-            and gradient[m].min() - threshold / 2
-            < 0
-            < gradient[m].max() + threshold / 2
-        ):
-            mask[m] = 1
+    # Separate clusters into two groups, those crossing the seam and the rest
+    index = np.arange(clusters.max() + 1)
+    lower = np.asarray(ndimage.minimum(gradient, clusters, index))
+    upper = np.asarray(ndimage.maximum(gradient, clusters, index))
+    crossing = (lower - threshold / 2 < 0) & (0 < upper + threshold / 2)
+    mask = crossing[clusters].astype(clusters.dtype)
 
     # Dither the mask's border, which works nicely for pixel art
     if dither_mask:
@@ -165,18 +260,53 @@ def make_seamless(
     return image
 
 
+def label_colors(image: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the unique colors of an image in lexicographic order, and the index of every pixel's color.
+
+    Colors are compared as packed byte keys in a single pass instead of row-wise.
+    """
+    pixels = np.ascontiguousarray(image.reshape(-1, image.shape[-1]))
+    if pixels.dtype.kind == "f":
+        # Make -0.0 and 0.0 pack to the same key
+        pixels = pixels + 0.0
+    keys = pixels.view(np.dtype((np.void, pixels.dtype.itemsize * pixels.shape[1])))
+    _, first, inverse = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+
+    # Byte order differs from numeric order, sort the (few) unique colors numerically
+    palette = pixels[first]
+    order = np.lexsort(palette.T[::-1])
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return palette[order], rank[inverse].reshape(image.shape[:-1])
+
+
 def get_color_palette(image: np.ndarray) -> np.ndarray:
-    return np.unique(image.reshape(-1, 4), axis=0)
+    return label_colors(image)[0]
 
 
 def match_colors(
-    source_colors: np.ndarray, target_colors: np.ndarray, prefer_unique: bool
+    source_colors: np.ndarray,
+    target_colors: np.ndarray,
+    prefer_unique: bool,
+    algorithm: str = "sorted",
 ) -> np.ndarray:
     """
     Returns the mapping from source color to the closest target color.
     If target < source, the mapping will be many-to-one, optionally preferring unique colors.
+
+    Source colors are assigned greedily, closest pair first. Preferring unique colors penalizes a target color by
+    one for every source color already assigned to it.
+
+    :param algorithm: "sorted" keeps the best candidate of each target color in a heap, "naive" searches the
+        whole distance matrix for every source color. Both yield identical results.
     """
     distances = cdist(source_colors, target_colors)
+    if algorithm == "sorted":
+        return _match_colors_sorted(distances, prefer_unique)
+    elif algorithm != "naive":
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+
     mapping = np.zeros((source_colors.shape[0],), dtype=np.int32)
 
     for _ in range(source_colors.shape[0]):
@@ -191,24 +321,96 @@ def match_colors(
     return mapping
 
 
+class PaletteMapping:
+    """
+    Remaps images onto a fixed target palette.
+
+    Create it once per target palette to remap many images, the matching of each distinct source palette is reused.
+    """
+
+    def __init__(
+        self,
+        target_palette: np.ndarray,
+        prefer_unique: bool = True,
+        max_entries: int = 64,
+    ) -> None:
+        self.target_palette = np.asarray(target_palette)
+        self.prefer_unique = prefer_unique
+        self.max_entries = max_entries
+
+        self._mappings: dict[bytes, np.ndarray] = {}
+
+    @staticmethod
+    def from_image(
+        palette: Image.Image, prefer_unique: bool = True
+    ) -> "PaletteMapping":
+        return PaletteMapping(
+            get_color_palette(image_to_np(palette.convert("RGBA"))), prefer_unique
+        )
+
+    def match(self, source_palette: np.ndarray) -> np.ndarray:
+        """Returns the index of the target color for each source color."""
+        key = source_palette.tobytes()
+        mapping = self._mappings.get(key)
+        if mapping is None:
+            mapping = match_colors(
+                source_palette, self.target_palette, self.prefer_unique
+            )
+            if len(self._mappings) >= self.max_entries:
+                self._mappings.pop(next(iter(self._mappings)))
+            self._mappings[key] = mapping
+        return mapping
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        source_palette, labels = label_colors(image)
+        mapping = self.match(source_palette)
+
+        # One gather from pixel label to target color
+        return self.target_palette[mapping].astype(image.dtype, copy=False)[labels]
+
+
+def _match_colors_sorted(distances: np.ndarray, prefer_unique: bool) -> np.ndarray:
+    if not prefer_unique:
+        # Without penalties, each source color simply takes its closest target
+        return np.argmin(distances, axis=1).astype(np.int32)
+
+    n, m = distances.shape
+
+    # Penalized like the naive search, column-major so a column is contiguous
+    distances = np.array(distances, dtype=np.float64, order="F")
+    assigned = np.zeros(n, dtype=bool)
+    mapping = np.zeros(n, dtype=np.int32)
+
+    def candidate(j: int) -> tuple[float, int, int]:
+        # The first minimum is the lowest index, as in the naive search
+        i = int(np.argmin(distances[:, j]))
+        return float(distances[i, j]), i, j
+
+    # The best source color per target color, ordered like the naive search's argmin over (value, row, column)
+    heap = [candidate(j) for j in range(m)]
+    heapq.heapify(heap)
+
+    for _ in range(n):
+        while True:
+            _, i, j = heapq.heappop(heap)
+            if not assigned[i]:
+                break
+            # Taken by another target color since, columns only change when picked themselves
+            heapq.heappush(heap, candidate(j))
+
+        assigned[i] = True
+        mapping[i] = j
+        distances[:, j] += 1
+        distances[i, :] = np.inf
+        heapq.heappush(heap, candidate(j))
+
+    return mapping
+
+
 def remap_image(
     image: np.ndarray, target_palette: np.ndarray, prefer_unique: bool = True
 ) -> np.ndarray:
-    source_palette = get_color_palette(image)
-    mapping = match_colors(source_palette, target_palette, prefer_unique)
-    remapped_image = np.zeros_like(image)
-
-    for i in range(len(mapping)):
-        c = source_palette[i]
-        mask = (
-            (image[:, :, 0] == c[0])
-            & (image[:, :, 1] == c[1])
-            & (image[:, :, 2] == c[2])
-            & (image[:, :, 3] == c[3])
-        )
-        remapped_image[mask] = target_palette[mapping[i]]
-
-    return remapped_image
+    return PaletteMapping(target_palette, prefer_unique)(image)
 
 
 def encode_file(image: np.ndarray) -> bytes:
@@ -227,7 +429,9 @@ def pixelize(
     factor: int = 16,
     min_distance: float = 6.0,
     seamless: bool = False,
-    palette: Image.Image | None = None,
+    palette: Image.Image | PaletteMapping | None = None,
+    quantization: str = "kmeans",
+    sample_size: int = 8192,
 ) -> Image.Image:
     """
     Applies the entire pixelation pipeline.
@@ -236,16 +440,46 @@ def pixelize(
     :param factor: Downscaling factor
     :param min_distance: Minimum distance between colors to be merged
     :param seamless: Whether to make the image seamless
-    :param palette: Optional target palette image
+    :param palette: Optional target palette image, or a mapping to reuse across images
+    :param quantization: Clustering algorithm of fix_palette, "minibatch" is much faster on large images
+    :param sample_size: Pixels sampled by "minibatch", trading quality for speed
     :return: Pixelated image
     """
+    if palette is not None and not isinstance(palette, PaletteMapping):
+        palette = PaletteMapping.from_image(palette)
+
+    data = pixelize_array(
+        image_to_np(image),
+        factor,
+        min_distance,
+        seamless,
+        palette,
+        quantization,
+        sample_size,
+    )
+    return Image.fromarray(data)
+
+
+def pixelize_array(
+    data: np.ndarray,
+    factor: int = 16,
+    min_distance: float = 6.0,
+    seamless: bool = False,
+    palette: PaletteMapping | None = None,
+    quantization: str = "kmeans",
+    sample_size: int = 8192,
+) -> np.ndarray:
+    """
+    Applies the entire pixelation pipeline to a float image as returned by image_to_np, see pixelize.
 
-    data = image_to_np(image)
+    :return: Pixelated 8-bit RGBA image
+    """
     data = downscale(data, factor)
-    data = fix_palette(data, min_distance)
+    data = fix_palette(
+        data, min_distance, algorithm=quantization, sample_size=sample_size
+    )
     if seamless:
         data = make_seamless(data)
     if palette is not None:
-        data = remap_image(data, get_color_palette(image_to_np(palette)))
-    data = to_8bit(data)
-    return Image.fromarray(data)
+        data = palette(data)
+    return to_8bit(data)
@@ -0,0 +1,181 @@
+import concurrent.futures
+import multiprocessing
+import os
+import uuid
+from multiprocessing import shared_memory
+from os import PathLike
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+from PIL import Image
+from threadpoolctl import threadpool_limits
+
+from horde_workspace.processors.pixelize import (
+    PaletteMapping,
+    image_to_np,
+    pixelize_array,
+)
+from horde_workspace.workspace import Workspace
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tga"}
+
+_options: dict = {}
+
+
+def find_images(directory: PathLike | str) -> Iterator[Path]:
+    """Recursively lists the images in a directory, sorted by path."""
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+            yield path
+
+
+def output_name(path: PathLike | str, root: PathLike | str | None = None) -> str:
+    """Name of the pixelized version of an image, e.g., pixelized/a/tex.jpg.png for a/tex.jpg below root."""
+    path = Path(path)
+    relative = path.relative_to(root) if root is not None else Path(path.name)
+    return f"pixelized/{relative.as_posix()}.png"
+
+
+def _init_worker(threads: int, options: dict) -> None:
+    # KMeans and BLAS would otherwise each use every core in every worker
+    threadpool_limits(threads)
+    _options.update(options)
+
+
+def _pixelize_shared(name: str, shape: tuple[int, ...]) -> tuple[int, ...]:
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        result = pixelize_array(
+            np.ndarray(shape, dtype=np.float32, buffer=memory.buf), **_options
+        )
+
+        # The result is smaller than the source, so it is written back over it
+        np.ndarray(result.shape, dtype=np.uint8, buffer=memory.buf)[...] = result
+        return result.shape
+    finally:
+        memory.close()
+
+
+def pixelize_many(
+    ws: Workspace,
+    images: Iterable[Image.Image | PathLike | str],
+    factor: int = 16,
+    min_distance: float = 6.0,
+    seamless: bool = False,
+    palette: Image.Image | PaletteMapping | None = None,
+    quantization: str = "kmeans",
+    sample_size: int = 8192,
+    max_workers: int | None = None,
+    threads_per_worker: int = 1,
+    max_in_flight: int | None = None,
+    return_exceptions: bool = False,
+    root: PathLike | str | None = None,
+) -> Iterator[tuple[Image.Image | PathLike | str, str | Exception]]:
+    """
+    Pixelizes images across a process pool and saves them to the workspace as PNG, see pixelize.
+
+    Images are handed to the workers through shared memory rather than pickled. Images given as paths keep their
+    file name, including the original suffix, under pixelized/, e.g., pixelized/tex.jpg.png, others get a random one.
+    Paths that would overwrite an earlier result are refused.
+
+    :param images: Images or paths to images, consumed lazily
+    :param max_workers: Worker processes, one per core if None
+    :param threads_per_worker: BLAS and OpenMP threads per worker
+    :param max_in_flight: Images held in shared memory at once, twice the workers if None
+    :param return_exceptions: Whether to yield exceptions instead of raising them
+    :param root: Directory the paths are named relative to, keeping their subdirectories, e.g., from find_images
+    :return: Pairs of the image and the saved name, in completion order
+    """
+    if palette is not None and not isinstance(palette, PaletteMapping):
+        palette = PaletteMapping.from_image(palette)
+    options = {
+        "factor": factor,
+        "min_distance": min_distance,
+        "seamless": seamless,
+        "palette": palette,
+        "quantization": quantization,
+        "sample_size": sample_size,
+    }
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or max_workers * 2
+    items = iter(images)
+    names: set[str] = set()
+
+    # Spawned, as forking would copy the workspace's client thread
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads_per_worker, options),
+    )
+    pending: dict[
+        concurrent.futures.Future,
+        tuple[Any, str | None, shared_memory.SharedMemory | None],
+    ] = {}
+
+    def submit() -> bool:
+        item = next(items, None)
+        if item is None:
+            return False
+
+        try:
+            if isinstance(item, Image.Image):
+                name = f"pixelized/{uuid.uuid4()}.png"
+                image = item
+            else:
+                name = output_name(item, root)
+                if name in names:
+                    raise ValueError(f"{item} would overwrite {name}")
+                names.add(name)
+                image = Image.open(item)
+            data = image_to_np(image.convert("RGBA"))
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            # Unreadable files and name collisions are reported like failed pixelizations
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+            pending[future] = (item, None, None)
+            return True
+
+        memory = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        np.ndarray(data.shape, dtype=np.float32, buffer=memory.buf)[...] = data
+        future = executor.submit(_pixelize_shared, memory.name, data.shape)
+        pending[future] = (item, name, memory)
+        return True
+
+    try:
+        while len(pending) < max_in_flight and submit():
+            pass
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                item, name, memory = pending.pop(future)
+                try:
+                    shape = future.result()
+                    data = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf).copy()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    result = e
+                else:
+                    result = ws.save(Image.fromarray(data), name)
+                finally:
+                    if memory is not None:
+                        memory.close()
+                        memory.unlink()
+
+                submit()
+                yield item, result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for _, _, memory in pending.values():
+            # Running workers keep their own mapping until they finish
+            if memory is not None:
+                memory.close()
+                memory.unlink()
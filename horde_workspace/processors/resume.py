@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Iterator
+
+import aiohttp
+
+from horde_workspace.processors.alchemist import (
+    AlchemyGeneration,
+    async_collect_alchemy,
+)
+from horde_workspace.processors.generate import GeneratedImage, async_stream_request
+from horde_workspace.utils import APIError, TransientAPIError
+from horde_workspace.workspace import Workspace
+
+
+def resume(
+    ws: Workspace, timeout: int = 1000
+) -> Iterator[tuple[dict, GeneratedImage | AlchemyGeneration]]:
+    """Synchronous version of async_resume."""
+    return ws.client.iterate(async_resume(ws, timeout))
+
+
+async def async_resume(
+    ws: Workspace, timeout: int = 1000
+) -> AsyncIterator[tuple[dict, GeneratedImage | AlchemyGeneration]]:
+    """
+    Collects the requests the journal still lists as in flight, e.g., after a crash or restart.
+
+    Generated images are saved to the workspace and yielded as they arrive, interrogations once done, with upscaled
+    images saved as well. Each result is paired with the journal entry of its submission, which for generations
+    includes the job.
+    """
+    results: asyncio.Queue[tuple[dict, GeneratedImage | AlchemyGeneration] | None] = (
+        asyncio.Queue()
+    )
+
+    async def collect(request_id: str, entry: dict) -> None:
+        try:
+            if entry.get("kind") == "interrogate":
+                alchemy = await async_collect_alchemy(ws, request_id, timeout)
+                if alchemy.image is not None:
+                    await asyncio.to_thread(
+                        ws.save_bytes, alchemy.image, f"{request_id}.webp"
+                    )
+                await results.put((entry, alchemy))
+            else:
+                async with contextlib.aclosing(
+                    async_stream_request(ws, request_id, True, timeout)
+                ) as images:
+                    async for image in images:
+                        await results.put((entry, image))
+        except (TransientAPIError, aiohttp.ClientError) as e:
+            # Leave it pending for the next attempt
+            logging.warning("Could not resume request %s: %s", request_id, e)
+            return
+        except APIError as e:
+            logging.warning("Could not resume request %s: %s", request_id, e)
+            ws.journal.record(request_id, "failed", error=str(e))
+            return
+        ws.journal.record(request_id, "done")
+
+    async def collect_all() -> None:
+        try:
+            await asyncio.gather(
+                *[collect(*item) for item in ws.journal.pending().items()]
+            )
+        finally:
+            await results.put(None)
+
+    ws.metrics.bind()
+    task = asyncio.create_task(collect_all())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+        await task
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import itertools
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future
+
+from horde_workspace.classes.job import Job
+from horde_workspace.processors.generate import (
+    Generation,
+    async_estimate_kudos,
+    async_generate_images,
+    build_payload,
+)
+from horde_workspace.utils import GenerationError, TransientAPIError, payload_hash
+from horde_workspace.workspace import Workspace
+
+
+class Priority:
+    URGENT = 0
+    NORMAL = 1
+    BACKGROUND = 2
+
+
+class KudosScheduler:
+    """
+    Holds and orders jobs in front of the Horde by priority and estimated cost, within a kudos budget.
+
+    Costs are estimated with a dry run before submission. Jobs start in priority order, and within a priority the
+    cheapest per image first. Each priority may only spend its share of the budget of the sliding window, so
+    background batches cannot drain the kudos urgent jobs need. If the next job does not fit, everything behind it
+    is held until enough spending leaves the window.
+    """
+
+    def __init__(
+        self,
+        ws: Workspace,
+        budget: float | None = None,
+        window: float = 60 * 60,
+        max_in_flight: int = 16,
+        shares: dict[int, float] | None = None,
+    ) -> None:
+        """
+        :param budget: Kudos that may be spent per window, unlimited if None
+        :param window: Length of the sliding budget window in seconds
+        :param max_in_flight: Jobs running at once
+        :param shares: Fraction of the budget each priority may spend
+        """
+        self.ws = ws
+        self.budget = budget
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.shares = shares or {
+            Priority.URGENT: 1.0,
+            Priority.NORMAL: 0.9,
+            Priority.BACKGROUND: 0.5,
+        }
+
+        self._queue: list[tuple[int, float, int, float, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._spending: deque[list[float]] = deque()
+        self._in_flight = 0
+        self._estimates: dict[str, asyncio.Future[float]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+        # Generations already charged, by id, as identical seeded jobs in flight at once share one
+        self._charged: weakref.WeakValueDictionary[int, Generation] = (
+            weakref.WeakValueDictionary()
+        )
+
+    @property
+    def spent(self) -> float:
+        """Kudos spent, or reserved by running jobs, within the current window."""
+        expired = time.monotonic() - self.window
+        while self._spending and self._spending[0][0] < expired:
+            self._spending.popleft()
+        return sum(amount for _, amount in self._spending)
+
+    @property
+    def queued(self) -> int:
+        return sum(not entry[-1].done() for entry in self._queue)
+
+    async def estimate(self, job: Job) -> float:
+        """Estimates the kudos of a job, memoized on everything but its prompt and seed."""
+        payload = build_payload(self.ws, job)
+        params = dict(payload["params"])
+        params.pop("seed", None)
+        key = payload_hash(
+            {
+                "models": payload["models"],
+                "params": params,
+                "img2img": "source_image" in payload,
+            }
+        )
+        # Concurrent estimates of equivalent jobs share one dry run
+        estimate = self._estimates.get(key)
+        if estimate is None:
+            estimate = asyncio.ensure_future(
+                async_estimate_kudos(self.ws.client, payload, self.ws.apikey)
+            )
+            self._estimates[key] = estimate
+        try:
+            return await asyncio.shield(estimate)
+        except Exception:
+            if self._estimates.get(key) is estimate:
+                del self._estimates[key]
+            raise
+
+    def generate(self, job: Job, priority: int = Priority.NORMAL) -> Future[Generation]:
+        """Schedules a job on the workspace's event loop."""
+        return self.ws.client.submit(self.async_generate(job, priority))
+
+    async def async_generate(
+        self, job: Job, priority: int = Priority.NORMAL
+    ) -> Generation:
+        """Waits for the job's turn and budget, then generates it."""
+        self.ws.metrics.bind()
+        cost = await self.estimate(job)
+        if self.budget is not None and cost > self.budget * self.shares.get(
+            priority, 1.0
+        ):
+            raise GenerationError(
+                f"Job costs {cost} kudos, exceeding its share of the budget"
+            )
+
+        record = await self._acquire(priority, cost, cost / max(job.n, 1))
+        try:
+            generation = await async_generate_images(self.ws, job)
+            if self._charged.get(id(generation)) is generation:
+                # Merged with another waiter's request, which was charged already
+                record[1] = 0.0
+            else:
+                self._charged[id(generation)] = generation
+                record[1] = generation.kudos
+            return generation
+        except TransientAPIError:
+            # The request may have finished and been charged, e.g., when only a download failed, keep the estimate
+            raise
+        except BaseException:
+            # Failed, impossible and cancelled requests are refunded by the Horde
+            record[1] = 0.0
+            raise
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
+
+    async def _acquire(
+        self, priority: int, cost: float, cost_per_image: float
+    ) -> list[float]:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queue,
+            (priority, cost_per_image, next(self._counter), cost, future),
+        )
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Granted right before being cancelled, give the slot back
+            if future.done() and not future.cancelled():
+                self._in_flight -= 1
+                future.result()[1] = 0.0
+                self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        while self._queue and self._in_flight < self.max_in_flight:
+            priority, _, _, cost, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            if (
+                self.budget is not None
+                and self.spent + cost > self.budget * self.shares.get(priority, 1.0)
+            ):
+                self._retry_later()
+                return
+
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+
+            # Reserve the estimate, corrected to the actual cost once known
+            record = [time.monotonic(), cost]
+            self._spending.append(record)
+            future.set_result(record)
+
+    def _retry_later(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._spending:
+            delay = self._spending[0][0] + self.window - time.monotonic()
+            self._timer = asyncio.get_running_loop().call_later(
+                max(0.0, delay), self._dispatch
+            )
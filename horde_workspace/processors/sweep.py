@@ -0,0 +1,91 @@
+import itertools
+import re
+from typing import Any, AsyncIterator, Iterable, Iterator, Mapping
+
+from horde_workspace.classes.job import Job
+from horde_workspace.processors.generate import Generation, async_generate_images
+from horde_workspace.utils import map_bounded
+from horde_workspace.workspace import Workspace
+
+# A name without whitespace, or an inline list whose options may contain spaces
+VARIABLE_PATTERN = re.compile(r"%([^%\s]+|[^%]*\|[^%]*)%")
+
+
+def expand_sweep(
+    template: Job, axes: Mapping[str, Iterable[Any]] | None = None
+) -> Iterator[tuple[dict[str, Any], Job]]:
+    """
+    Lazily expands a template job into one job per combination of the axes.
+
+    Axes named after a Job field, e.g., model, seed, size or loras, set that field. Any axis can also be referenced
+    as %name% in the prompt or negative prompt. Inline lists such as %red|green|blue% or %red car|blue car% form an
+    axis of their own, keyed by their text. Values are validated like Job fields, invalid ones raise a
+    ValidationError. Other %snippet% references are left for payload building to expand.
+
+    Only the values of each axis are kept in memory, never the cross product.
+
+    :return: Pairs of the parameters of a combination and its job
+    """
+    axes = {name: tuple(values) for name, values in (axes or {}).items()}
+    for text in (template.prompt, template.negprompt):
+        for match in VARIABLE_PATTERN.finditer(text):
+            name = match[1]
+            if name not in axes and "|" in name:
+                axes[name] = tuple(name.split("|"))
+
+    fields = [name for name in axes if name in Job.model_fields]
+
+    for values in itertools.product(*axes.values()):
+        params = dict(zip(axes, values))
+
+        def substitute(match: re.Match) -> str:
+            name = match[1]
+            return str(params[name]) if name in params else match[0]
+
+        update = {name: params[name] for name in fields}
+        update["prompt"] = VARIABLE_PATTERN.sub(substitute, template.prompt)
+        update["negprompt"] = VARIABLE_PATTERN.sub(substitute, template.negprompt)
+
+        # Validated, so e.g. numeric seeds become strings like the Horde expects
+        yield params, Job.model_validate({**dict(template), **update})
+
+
+def sweep(
+    ws: Workspace,
+    template: Job,
+    axes: Mapping[str, Iterable[Any]] | None = None,
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> Iterator[tuple[dict[str, Any], Generation | Exception]]:
+    """Synchronous version of async_sweep, yielding results in completion order."""
+    return ws.client.iterate(
+        async_sweep(ws, template, axes, max_in_flight, return_exceptions)
+    )
+
+
+async def async_sweep(
+    ws: Workspace,
+    template: Job,
+    axes: Mapping[str, Iterable[Any]] | None = None,
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> AsyncIterator[tuple[dict[str, Any], Generation | Exception]]:
+    """
+    Generates every combination of a sweep concurrently, see expand_sweep.
+
+    Usage::
+
+        template = Job(prompt="a %red|green% %animal%, %good%", model="Deliberate")
+        axes = {"animal": ["cat", "dog"], "seed": ["1", "2"]}
+        async for params, generation in async_sweep(ws, template, axes):
+            ...
+
+    Yields (params, generation) pairs as they complete.
+    """
+    async for (params, _), result in map_bounded(
+        lambda item: async_generate_images(ws, item[1]),
+        expand_sweep(template, axes),
+        max_in_flight,
+        return_exceptions,
+    ):
+        yield params, result
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import math
+import time
+
+from attr import dataclass
+
+from horde_workspace.classes.job import Job
+from horde_workspace.client import HordeClient
+from horde_workspace.payload import compile_model
+
+
+@dataclass
+class Route:
+    job: Job
+    expected_latency: float
+    workers: list[str] | None = None
+    slow_workers: bool | None = None
+    trusted_workers: bool | None = None
+
+
+class WorkerRouter:
+    """
+    Routes jobs to the model and workers with the lowest expected latency, based on Horde worker stats.
+
+    Model and worker availability is fetched at most every ttl seconds and shared by all jobs. The expected latency
+    of a model blends the Horde's ETA with a moving average of the latencies observed locally, per model and
+    resolution. Jobs are only moved to alternatives explicitly allowed for their model.
+    """
+
+    def __init__(
+        self,
+        client: HordeClient,
+        alternatives: dict[str, list[str]] | None = None,
+        ttl: float = 60.0,
+        smoothing: float = 0.3,
+        pin_workers: bool = False,
+        max_workers: int = 5,
+        prefer_fast: bool = False,
+        fast_performance: float = 0.5,
+    ) -> None:
+        """
+        :param alternatives: Interchangeable models per model, by registry name
+        :param ttl: How long fetched worker stats are used in seconds
+        :param smoothing: Weight of a new observation in the moving average
+        :param pin_workers: Whether to restrict jobs to the fastest workers serving their model
+        :param prefer_fast: Whether to exclude slow workers when enough fast ones are available, at extra kudos cost
+        :param fast_performance: Megapixelsteps per second from which a worker counts as fast
+        """
+        self.client = client
+        self.alternatives = alternatives or {}
+        self.ttl = ttl
+        self.smoothing = smoothing
+        self.pin_workers = pin_workers
+        self.max_workers = max_workers
+        self.prefer_fast = prefer_fast
+        self.fast_performance = fast_performance
+
+        self.models: dict[str, dict] = {}
+        self.workers: list[dict] = []
+        self.observed: dict[tuple[str, int], float] = {}
+
+        self._fetched = -math.inf
+        self._refresh: asyncio.Future | None = None
+
+    async def refresh(self, force: bool = False) -> None:
+        """Fetches model and worker availability, unless the cached stats are still fresh."""
+        if not force and time.monotonic() - self._fetched < self.ttl:
+            return
+
+        # Concurrent jobs share one refresh
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._fetch())
+        await asyncio.shield(self._refresh)
+
+    async def _fetch(self) -> None:
+        headers = {"Client-Agent": self.client.client_agent}
+        try:
+            models, workers = await asyncio.gather(
+                self.client.request(
+                    "GET", self.client.url("status/models?type=image"), headers
+                ),
+                self.client.request(
+                    "GET", self.client.url("workers?type=image"), headers
+                ),
+            )
+            self.models = {model["name"]: model for model in models}
+            self.workers = workers
+        finally:
+            # Failed fetches keep the previous stats until the next refresh is due
+            self._fetched = time.monotonic()
+
+    @staticmethod
+    def _bucket(pixels: int) -> int:
+        # Quarter megapixel resolution classes
+        return round(pixels / 262144)
+
+    @staticmethod
+    def _performance(worker: dict) -> float:
+        try:
+            return float(str(worker.get("performance", "0")).split()[0])
+        except ValueError:
+            return 0.0
+
+    def observe(self, model: str, pixels: int, latency: float) -> None:
+        """Records the time from submission to completion of a job."""
+        key = (model, self._bucket(pixels))
+        previous = self.observed.get(key)
+        self.observed[key] = (
+            latency
+            if previous is None
+            else previous + self.smoothing * (latency - previous)
+        )
+
+    def candidates(self, model: str, pixels: int) -> list[dict]:
+        """The online workers able to serve a model at the given resolution, fastest first."""
+        workers = [
+            worker
+            for worker in self.workers
+            if worker.get("online", True)
+            and not worker.get("maintenance_mode", False)
+            and model in worker.get("models", [])
+            and worker.get("max_pixels", pixels) >= pixels
+        ]
+        return sorted(workers, key=self._performance, reverse=True)
+
+    def expected_latency(self, model: str, pixels: int) -> float:
+        status = self.models.get(model)
+        if self.models and (status is None or not status.get("count")):
+            # Nobody serves it right now
+            return math.inf
+
+        observed = self.observed.get((model, self._bucket(pixels)))
+        if status is None:
+            return math.inf if observed is None else observed
+        eta = float(status.get("eta", 0))
+        return eta if observed is None else (eta + observed) / 2
+
+    async def route(self, job: Job, trusted_workers: bool = False) -> Route:
+        """Picks the model and worker settings for a job."""
+        try:
+            await self.refresh()
+        except Exception as e:
+            # Routing is an optimization, never fail a job because of it
+            logging.warning("Could not refresh worker stats: %s", e)
+
+        pixels = (
+            job.width * job.height
+            if job.size is None
+            else job.size.width * job.size.height
+        )
+
+        best_job = job
+        best_latency = math.inf
+        options = [job.model]
+        if isinstance(job.model, str):
+            options += self.alternatives.get(job.model, [])
+        for option in options:
+            latency = self.expected_latency(compile_model(option).name, pixels)
+            if latency < best_latency:
+                best_job = (
+                    job
+                    if option is job.model
+                    else job.model_copy(update={"model": option})
+                )
+                best_latency = latency
+
+        route = Route(job=best_job, expected_latency=best_latency)
+        candidates = self.candidates(compile_model(best_job.model).name, pixels)
+        if not candidates:
+            return route
+
+        # Requiring trusted workers would leave the job stuck if none serves the model
+        if trusted_workers and not any(w.get("trusted") for w in candidates):
+            route.trusted_workers = False
+
+        fast = [w for w in candidates if self._performance(w) >= self.fast_performance]
+        if self.prefer_fast and len(fast) >= 2:
+            route.slow_workers = False
+
+        if self.pin_workers:
+            route.workers = [w["id"] for w in candidates[: self.max_workers]]
+
+        return route
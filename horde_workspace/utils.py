@@ -1,39 +1,127 @@
+import asyncio
 import base64
+import hashlib
 import io
+import json
+import os
 import urllib.parse
-from typing import TypeVar
+from os import PathLike
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Iterable, TypeVar
 
 import aiohttp
-import requests
 from PIL import Image
 
-
-def get(url) -> dict:
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise ValueError(f"Failed to resolve model: {response.text}")
+from horde_workspace.ratelimit import backoff_delay
 
 
-async def download_image(aiohttp_session: aiohttp.ClientSession, url: str) -> bytes:
+async def download_image(
+    aiohttp_session: aiohttp.ClientSession, url: str, retries: int = 3
+) -> bytes:
     """Asynchronously convert from base64 or download an image from a response."""
     if urllib.parse.urlparse(url).scheme in {"http", "https"}:
-        async with aiohttp_session.get(url) as response:
-            if response.status != 200:
-                response.raise_for_status()
+        attempt = 0
+        while True:
+            try:
+                async with aiohttp_session.get(url) as response:
+                    if response.status != 200:
+                        response.raise_for_status()
 
-            return await response.read()
+                    return await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Downloads are idempotent and safe to retry
+                if attempt >= retries:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
     else:
         return base64.b64decode(url)
 
 
-def b64_encode_image(image: Image.Image) -> str:
+async def download_to_file(
+    aiohttp_session: aiohttp.ClientSession,
+    url: str,
+    path: PathLike | str,
+    retries: int = 3,
+    chunk_size: int = 64 * 1024,
+    buffer_size: int = 1024 * 1024,
+) -> str:
+    """
+    Streams an image from a response into a file as is, without holding it in memory.
+
+    The file only appears once complete. Returns the sha256 of its bytes, computed on the fly.
+
+    :param buffer_size: Bytes collected before each write, which runs in a worker thread to not block the event loop
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.part")
+    await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+
+    replaced = False
+    try:
+        if urllib.parse.urlparse(url).scheme not in {"http", "https"}:
+            data = base64.b64decode(url)
+            await asyncio.to_thread(tmp.write_bytes, data)
+            os.replace(tmp, path)
+            replaced = True
+            return hashlib.sha256(data).hexdigest()
+
+        attempt = 0
+        while True:
+            digest = hashlib.sha256()
+            try:
+                async with aiohttp_session.get(url) as response:
+                    if response.status != 200:
+                        response.raise_for_status()
+
+                    with await asyncio.to_thread(open, tmp, "wb") as f:
+                        buffer = bytearray()
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            digest.update(chunk)
+                            buffer += chunk
+                            if len(buffer) >= buffer_size:
+                                await asyncio.to_thread(f.write, bytes(buffer))
+                                buffer.clear()
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                os.replace(tmp, path)
+                replaced = True
+                return digest.hexdigest()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Downloads are idempotent and safe to retry
+                if attempt >= retries:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+    finally:
+        # Failed, cancelled or otherwise abandoned downloads leave no partial file behind
+        if not replaced:
+            tmp.unlink(missing_ok=True)
+
+
+def payload_hash(payload: dict) -> str:
+    """Hashes the canonical JSON form of a payload."""
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def b64_encode_image(
+    image: Image.Image, quality: int = 80, method: int = 4, lossless: bool = False
+) -> str:
     buffered = io.BytesIO()
-    image.save(buffered, format="webp")
+    image.save(
+        buffered, format="webp", quality=quality, method=method, lossless=lossless
+    )
     return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
 
+class APIError(Exception):
+    pass
+
+
+class TransientAPIError(APIError):
+    """A request failed for a reason which may go away when trying again later."""
+
+
 class GenerationError(Exception):
     def __init__(self, reason: str) -> None:
         self.reason = reason
@@ -43,6 +131,51 @@ class GenerationError(Exception):
 
 
 T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def map_bounded(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    max_in_flight: int = 16,
+    return_exceptions: bool = False,
+) -> AsyncIterator[tuple[T, R | Exception]]:
+    """
+    Applies func to many items concurrently on the running event loop.
+
+    Items are pulled lazily from the iterable, at most max_in_flight of them are in flight at once.
+    Yields (item, result) pairs as they complete. If return_exceptions is set, failed items yield their
+    exception instead of aborting the batch.
+    """
+    items = iter(items)
+    pending: dict[asyncio.Task, T] = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    pending[asyncio.ensure_future(func(item))] = item
+
+            if not pending:
+                return
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    yield item, task.result()
+                elif return_exceptions and isinstance(error, Exception):
+                    yield item, error
+                else:
+                    raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
 
 def assert_none(value: T | None) -> T:
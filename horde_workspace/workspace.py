@@ -6,11 +6,20 @@ from pathlib import Path
 from PIL import Image
 from dotenv import load_dotenv
 
+from horde_workspace.cache import ResultCache
+from horde_workspace.client import HordeClient
+from horde_workspace.encoding import ImageEncoder
+from horde_workspace.journal import Journal
+from horde_workspace.metrics import Metrics, record_request
+from horde_workspace.router import WorkerRouter
+
 load_dotenv()
 
 
 class Workspace:
-    def __init__(self, directory: PathLike | str = "output") -> None:
+    def __init__(
+        self, directory: PathLike | str = "output", client: HordeClient | None = None
+    ) -> None:
         super().__init__()
 
         self.directory = Path(directory)
@@ -24,6 +33,35 @@ class Workspace:
         self.workers = []
         self.kudos = 0
 
+        # Clients passed in may be shared with other workspaces and are closed by their owner
+        self.owns_client = client is None
+        if client is None:
+            client = HordeClient()
+            client.base_url = os.getenv("HORDE_API_URL") or client.base_url
+        self.client = client
+        self.journal = Journal(self.directory / "journal.jsonl")
+        self.cache = ResultCache(self.directory / "cache")
+        self.encoder = ImageEncoder()
+
+        # HTTP calls are recorded into the metrics of the workspace that made them, see Metrics.bind
+        self.metrics = Metrics()
+        if record_request not in self.client.hooks:
+            self.client.hooks.append(record_request)
+
+        # Optional, picks models and workers per job from live worker stats
+        self.router: WorkerRouter | None = None
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the pooled connections of this workspace, unless its client was passed in."""
+        if self.owns_client:
+            self.client.close()
+
     def save(self, image: Image.Image, name: str | None = None) -> str:
         if name is None:
             name = f"{uuid.uuid4()}.webp"
@@ -34,6 +72,17 @@ class Workspace:
 
         return name
 
+    def save_bytes(self, data: bytes, name: str | None = None) -> str:
+        """Saves already encoded image bytes verbatim, e.g., the WebP files returned by the Horde."""
+        if name is None:
+            name = f"{uuid.uuid4()}.webp"
+
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+        return name
+
     def exists(self, name: str) -> bool:
         return (self.directory / name).exists()
 
@@ -45,3 +94,7 @@ class Workspace:
 
     def get_kudos(self) -> int:
         return self.kudos
+
+    def summary(self) -> dict:
+        """Kudos spent and a summary of the metrics recorded by this workspace."""
+        return {"kudos": self.kudos, **self.metrics.summary()}
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from typing import Iterator
+
+from horde_workspace.classes.job import Job
+from horde_workspace.client import HordeClient
+from horde_workspace.fake_horde import FakeHorde
+from horde_workspace.processors.generate import async_generate_many
+from horde_workspace.workspace import Workspace
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def benchmark(args: argparse.Namespace, directory: str) -> None:
+    async with FakeHorde(
+        latency=args.latency,
+        queue_delay=args.queue_delay,
+        process_time=args.process_time,
+        rate_limit=args.rate_limit,
+        fault_rate=args.fault_rate,
+        image_size=args.image_size,
+    ) as horde:
+        client = HordeClient(
+            base_url=horde.url,
+            max_poll_rate=args.poll_rate or None,
+            max_request_rate=args.request_rate,
+        )
+        ws = Workspace(directory, client)
+        client.poller.min_interval = args.poll_interval
+        if args.max_poll_interval is not None:
+            client.poller.max_interval = args.max_poll_interval
+
+        started: dict[int, float] = {}
+        latencies: list[float] = []
+        failures = 0
+
+        def jobs() -> Iterator[Job]:
+            for i in range(args.jobs):
+                job = Job(prompt=f"benchmark {i}", model="Deliberate", n=args.n)
+                started[id(job)] = time.monotonic()
+                yield job
+
+        start = time.monotonic()
+        async for job, result in async_generate_many(
+            ws, jobs(), args.concurrency, return_exceptions=True
+        ):
+            latencies.append(time.monotonic() - started.pop(id(job)))
+            if isinstance(result, Exception):
+                failures += 1
+        elapsed = time.monotonic() - start
+
+        await ws.client.aclose()
+
+    print(f"Jobs:             {args.jobs} ({failures} failed)")
+    print(f"Elapsed:          {elapsed:.2f}s")
+    print(f"Throughput:       {args.jobs / elapsed:.2f} jobs/s")
+    print(f"Latency p50:      {statistics.median(latencies):.2f}s")
+    print(f"Latency p99:      {percentile(latencies, 0.99):.2f}s")
+    print(f"Connections:      {horde.connections} (peak {horde.peak_connections})")
+    print(f"Requests:         {sum(horde.counts.values())}")
+    for route, count in sorted(horde.counts.items()):
+        print(f"  {route:40} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-tests the Horde client against a local stand-in server."
+    )
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--n", type=int, default=1, help="Images per job")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--queue-delay", type=float, default=2.0)
+    parser.add_argument("--process-time", type=float, default=1.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--max-poll-interval", type=float, default=None)
+    parser.add_argument(
+        "--poll-rate",
+        type=float,
+        default=5.0,
+        help="Base budget of checks per second, growing by one per outstanding request, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--request-rate",
+        type=float,
+        default=None,
+        help="Requests per second, unlimited if omitted",
+    )
+    args = parser.parse_args()
+
+    # Journal and cache of load tests are thrown away
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(benchmark(args, directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import importlib
+import time
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+from skimage.color import rgb2lab
+
+# The processors package re-exports the pixelize function under the module's name
+pixelize = importlib.import_module("horde_workspace.processors.pixelize")
+
+
+def measure(func: Callable[[], np.ndarray], repeat: int) -> tuple[float, np.ndarray]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_palette(args: argparse.Namespace, colors: int) -> None:
+    rng = np.random.default_rng(args.seed)
+
+    # Quantized colors, so ties are exercised as well
+    source = rng.integers(0, 32, (colors, 4)).astype(np.float64) * 8
+    target = rng.integers(0, 32, (args.target, 4)).astype(np.float64) * 8
+
+    for prefer_unique in (True, False):
+        naive, expected = measure(
+            lambda: pixelize.match_colors(source, target, prefer_unique, "naive"),
+            args.repeat,
+        )
+        fast, result = measure(
+            lambda: pixelize.match_colors(source, target, prefer_unique, "sorted"),
+            args.repeat,
+        )
+        assert np.array_equal(expected, result), "match_colors results differ"
+        print(
+            f"match_colors  {colors:5} -> {args.target:3} unique={prefer_unique!s:5} "
+            f"naive {naive * 1000:9.1f}ms  sorted {fast * 1000:8.1f}ms  {naive / fast:6.1f}x"
+        )
+
+    naive, expected = measure(
+        lambda: pixelize.merge_clusters(
+            source.copy(), args.min_distance, args.target, "naive"
+        ),
+        args.repeat,
+    )
+    fast, result = measure(
+        lambda: pixelize.merge_clusters(
+            source.copy(), args.min_distance, args.target, "sorted"
+        ),
+        args.repeat,
+    )
+    assert np.array_equal(expected, result), "merge_clusters results differ"
+    print(
+        f"merge_clusters {colors:5} -> {len(result):3}              "
+        f"naive {naive * 1000:9.1f}ms  sorted {fast * 1000:8.1f}ms  {naive / fast:6.1f}x"
+    )
+
+
+def load_image(args: argparse.Namespace) -> np.ndarray:
+    if args.image is not None:
+        return pixelize.image_to_np(Image.open(args.image).convert("RGBA"))
+
+    # Noisy gradients, a worst case for palette fitting
+    rng = np.random.default_rng(args.seed)
+    y, x = np.mgrid[0 : args.size, 0 : args.size] / args.size
+    image = np.stack([x, y, (np.sin(x * 9) + 1) / 2, np.ones_like(x)], axis=-1)
+    image[:, :, :3] += rng.normal(0, 0.05, image[:, :, :3].shape)
+    return np.clip(image, 0, 1).astype(np.float32)
+
+
+def color_error(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean CIE76 color difference."""
+    return float(
+        np.linalg.norm(rgb2lab(a[:, :, :3]) - rgb2lab(b[:, :, :3]), axis=-1).mean()
+    )
+
+
+def benchmark_quantization(args: argparse.Namespace, factor: int) -> None:
+    image = pixelize.downscale(load_image(args), factor)
+
+    reference, expected = measure(
+        lambda: pixelize.fix_palette(image, args.palette_distance), 1
+    )
+    print(
+        f"fix_palette {image.shape[1]}x{image.shape[0]} kmeans                 "
+        f"{reference:6.2f}s  error {color_error(image, expected):5.2f}"
+    )
+    for sample_size in args.sample_sizes:
+        elapsed, result = measure(
+            lambda: pixelize.fix_palette(
+                image,
+                args.palette_distance,
+                algorithm="minibatch",
+                sample_size=sample_size,
+            ),
+            1,
+        )
+        print(
+            f"fix_palette {image.shape[1]}x{image.shape[0]} minibatch {sample_size:6}     "
+            f"{elapsed:6.2f}s  error {color_error(image, result):5.2f}  "
+            f"vs kmeans {color_error(expected, result):5.2f}  {reference / elapsed:5.1f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the palette algorithms of the pixelizer against their exact versions."
+    )
+    parser.add_argument("--colors", type=int, nargs="*", default=[256, 1024])
+    parser.add_argument("--target", type=int, default=32, help="Target palette size")
+    parser.add_argument("--min-distance", type=float, default=24.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--palette-distance",
+        type=float,
+        default=6.0,
+        help="Lab distance of fix_palette",
+    )
+    parser.add_argument("--image", help="Image to quantize, noisy gradients if omitted")
+    parser.add_argument("--size", type=int, default=1024, help="Generated image size")
+    parser.add_argument("--factors", type=int, nargs="*", default=[16, 4])
+    parser.add_argument(
+        "--sample-sizes", type=int, nargs="+", default=[2048, 8192, 32768]
+    )
+    args = parser.parse_args()
+
+    for colors in args.colors:
+        benchmark_palette(args, colors)
+    for factor in args.factors:
+        benchmark_quantization(args, factor)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from horde_workspace.classes.job import Job
 from horde_workspace.classes.resolutions import Sizes
 from horde_workspace.data import LORAS, EMBEDDINGS
-from horde_workspace.processors import upscale, generate_images, nsfw, caption
+from horde_workspace.processors import AlchemyForm, alchemist, generate_images
 from horde_workspace.workspace import Workspace
 
 
@@ -18,13 +18,18 @@ def main():
 
     image = generate_images(ws, job).get_image()
 
-    print("NSFW:", nsfw(ws, image))
-    print("Caption:", caption(ws, image))
+    # One upload and one queue slot for the whole post-processing chain
+    alchemy = alchemist(
+        ws, image, [AlchemyForm.NSFW, AlchemyForm.CAPTION, AlchemyForm.UPSCALE]
+    )
+
+    print("NSFW:", alchemy.nsfw)
+    print("Caption:", alchemy.caption)
 
     # TODO: Interrogation is not working
     # print("Interrogation:", interrogation(ws, image))
 
-    image = upscale(ws, image)
+    image = alchemy.get_image()
 
     name = ws.save(image)
     print(f"Saved image as {name}")
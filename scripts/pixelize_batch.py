@@ -0,0 +1,63 @@
+import argparse
+import time
+
+from PIL import Image
+
+from horde_workspace.processors import pixelize_many
+from horde_workspace.processors.pixelize_batch import find_images
+from horde_workspace.workspace import Workspace
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pixelizes every image of a directory across a process pool."
+    )
+    parser.add_argument("input", help="Directory of images to pixelize")
+    parser.add_argument("--output", default="output/pixelart")
+    parser.add_argument("--factor", type=int, default=16)
+    parser.add_argument("--min-distance", type=float, default=6.0)
+    parser.add_argument("--seamless", action="store_true")
+    parser.add_argument("--palette", help="Image whose colors to remap onto")
+    parser.add_argument(
+        "--quantization", choices=["kmeans", "minibatch"], default="kmeans"
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=8192,
+        help="Pixels sampled by minibatch quantization",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=1, help="Threads per worker")
+    args = parser.parse_args()
+
+    with Workspace(args.output) as ws:
+        start = time.monotonic()
+        done = failed = 0
+        for path, result in pixelize_many(
+            ws,
+            find_images(args.input),
+            factor=args.factor,
+            min_distance=args.min_distance,
+            seamless=args.seamless,
+            palette=args.palette and Image.open(args.palette),
+            quantization=args.quantization,
+            sample_size=args.sample_size,
+            max_workers=args.workers,
+            threads_per_worker=args.threads,
+            return_exceptions=True,
+            root=args.input,
+        ):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{path}: {result}")
+            else:
+                done += 1
+                print(f"{path} -> {result}")
+
+        elapsed = time.monotonic() - start
+        print(f"Pixelized {done} images ({failed} failed) in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()